@@ -0,0 +1,136 @@
+# reproducible ticks-per-second benchmark across land radius and population.
+# Results are written as JSON so runs can be compared against each other.
+import engine as en
+import land as ld
+import living as lv
+import probe as pr
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from typing import Dict, List
+
+def build_world(radius:int, population:int, seed:int):
+	land = ld.Land(radius, 800, 20, seed=seed)
+	livings = en.populate(land, population)
+	return land, livings
+
+def peak_memory(radius:int, population:int, seed:int, ticks:int):
+	# traced separately, tracemalloc slows the timed run down too much
+	tracemalloc.start()
+	try:
+		land, livings = build_world(radius, population, seed)
+		en.run(land, livings, ticks)
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def bench(radius:int, population:int, ticks:int, seed:int):
+	build_start = time.perf_counter()
+	land, livings = build_world(radius, population, seed)
+	build_time = time.perf_counter() - build_start
+
+	probe = pr.Probe()
+	start = time.perf_counter()
+	en.run(land, livings, ticks, probe)
+	elapsed = time.perf_counter() - start
+	summary = probe.summary()
+	return {
+		'radius': radius,
+		'cells': len(land.cells),
+		'population': population,
+		'ticks': ticks,
+		'seed': seed,
+		'build_s': build_time,
+		'elapsed_s': elapsed,
+		'ticks_per_s': ticks / max(elapsed, 1e-9),
+		'phase_s': summary['phase_s_per_tick'],
+		'counters_per_tick': {name:n / ticks for name, n in summary['counters'].items()},
+		'peak_memory_bytes': peak_memory(radius, population, seed, min(ticks, 10)),
+		'alive': sum(1 for l in livings if l.state != lv.LivingState.DEAD),
+	}
+
+def environment():
+	return {
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+	}
+
+def regressions(results:List[Dict], baseline:List[Dict], tolerance:float):
+	# runs that lost more than 'tolerance' of the baseline's ticks per second
+	old = {(r['radius'], r['population'], r['ticks'], r['seed']):r for r in baseline}
+	slower = []
+	for r in results:
+		key = (r['radius'], r['population'], r['ticks'], r['seed'])
+		if key in old and r['ticks_per_s'] < old[key]['ticks_per_s'] * (1.0 - tolerance):
+			slower.append((r, old[key]))
+	return slower
+
+def main(argv:List[str] = None):
+	parser = argparse.ArgumentParser(description='Benchmark world ticks per second.')
+	parser.add_argument('--radius', type=int, nargs='+', default=[10, 50, 100], help='land radii to run')
+	parser.add_argument('--population', type=int, nargs='+', default=[10, 100], help='living counts to run')
+	parser.add_argument('--ticks', type=int, default=100, help='ticks per run')
+	parser.add_argument('--seed', type=int, default=0, help='random seed for placement and movement')
+	parser.add_argument('--out', default='benchmark.json', help='JSON file to write the results to')
+	parser.add_argument('--baseline', help='earlier results to compare ticks per second against')
+	parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown against the baseline')
+	args = parser.parse_args(argv)
+
+	results = []
+	for radius in args.radius:
+		for population in args.population:
+			result = bench(radius, population, args.ticks, args.seed)
+			results.append(result)
+			phases = ', '.join('{} {:.2f}ms'.format(name, t * 1000) for name, t in result['phase_s'].items())
+			print('radius {:>4} population {:>5}: {:8.1f} ticks/s, peak {:.1f} MiB ({})'.format(
+				radius, population, result['ticks_per_s'], result['peak_memory_bytes'] / 2**20, phases))
+
+	with open(args.out, 'w') as f:
+		json.dump({'environment': environment(), 'results': results}, f, indent='\t')
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)['results']
+		slower = regressions(results, baseline, args.tolerance)
+		for new, old in slower:
+			print('REGRESSION radius {} population {}: {:.1f} -> {:.1f} ticks/s'.format(
+				new['radius'], new['population'], old['ticks_per_s'], new['ticks_per_s']))
+		if slower:
+			sys.exit(1)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_bench_reproducible():
+	a = bench(4, 5, 5, 1)
+	b = bench(4, 5, 5, 1)
+	equal_int('bench cells', a['cells'], 61)
+	equal_int('bench phases', sorted(a['phase_s']), sorted(phase.name for phase in en.Phases))
+	equal_int('bench reproducible', a['alive'], b['alive'])
+
+def test_regressions():
+	old = [{'radius': 1, 'population': 1, 'ticks': 1, 'seed': 0, 'ticks_per_s': 100.0}]
+	new = [{'radius': 1, 'population': 1, 'ticks': 1, 'seed': 0, 'ticks_per_s': 80.0}]
+	equal_int('regression found', len(regressions(new, old, 0.1)), 1)
+	equal_int('regression tolerated', len(regressions(new, old, 0.3)), 0)
+
+def test_all():
+	test_bench_reproducible()
+	test_regressions()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,47 @@
+# read and write halves of a piece of world state. A phase reads one array
+# and writes the other; when it ends the two are swapped by pointer, so no
+# phase ever sees another's half-written state.
+import numpy as np
+
+class DoubleBuffer:
+	def __init__(self, read:np.ndarray, write:np.ndarray = None):
+		self.read = read
+		self.write = read.copy() if write is None else write
+
+	def __repr__(self):
+		return 'DoubleBuffer(shape:{}, dtype:{})'.format(self.read.shape, self.read.dtype)
+
+	def swap(self):
+		self.read, self.write = self.write, self.read
+
+	def sync(self):
+		# for writers that only touch part of the array: the write half starts
+		# from the state just published
+		np.copyto(self.write, self.read)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_swap():
+	b = DoubleBuffer(np.zeros(4, dtype=np.int32))
+	read = b.read
+	b.write[1] = 5
+	equal_int('write hidden', b.read[1], 0)
+	b.swap()
+	equal_int('swap publishes', b.read[1], 5)
+	equal_int('swap by pointer', b.write is read, True)
+	b.sync()
+	equal_int('sync', b.write.tolist(), [0, 5, 0, 0])
+
+def test_all():
+	test_swap()
+
+if __name__ == '__main__':
+	test_all()
@@ -0,0 +1,247 @@
+# compact binary checkpoints of a world: smell and entity state are flattened
+# into arrays and written as an uncompressed .npz, never as a pickled object graph
+import field as fd
+import land as ld
+import living as lv
+import hex as pl
+import storage as st
+import json
+import os
+import threading
+import numpy as np
+from typing import Dict, Iterable, List
+
+Version = 1
+
+def ragged(lists:List[List[int]]):
+	# flattens a list of int lists into (offsets, values)
+	offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+	offsets[1:] = np.cumsum([len(x) for x in lists])
+	values = np.fromiter((v for x in lists for v in x), dtype=np.int64, count=int(offsets[-1]))
+	return offsets, values
+
+def unragged(offsets:np.ndarray, values:np.ndarray):
+	return [values[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+def snapshot(land:ld.Land, livings:Iterable[lv.Living]):
+	# copies everything a checkpoint needs into fresh arrays, so the world can
+	# keep ticking while they are written
+	entities = list(livings)
+	index = {l:i for i, l in enumerate(entities)}
+	for source in land.field.sources:
+		if source is not None and source not in index:
+			index[source] = len(entities)
+			entities.append(source)
+
+	# the field is mostly empty, so only its non-zero (cell, column) entries
+	# are kept. Memory-mapped arrays are copied the same way: the world keeps
+	# writing to its files after the checkpoint
+	field = land.field
+	occupied = field.occupied()
+	rows, cols = np.nonzero(field.strength[occupied, :len(field.sources)])
+	rows = occupied[rows]
+	random = land.random.state()
+	random_buffer = np.array(random.pop('buffer'), dtype=np.float64) # as an array, not JSON text
+	directions = {d:i for i, d in enumerate(pl.Directions)}
+	hunt = [l.hunt_smell for l in entities]
+
+	meta = {
+		'version': Version,
+		'radius': land.radius,
+		'screen_size': land.screen_size,
+		'terrain_size': land.terrain_size,
+		'tick': land.tick,
+		'seed': land.seed,
+		'random': random,
+		'uids': [l.uid for l in entities],
+		'names': [l.name for l in entities],
+	}
+	if isinstance(land.storage, st.Mapped):
+		# resumed into new files in the same directory
+		meta['storage'] = {'directory': os.path.abspath(land.storage.directory)}
+	arrays = {
+		'meta': np.array(json.dumps(meta)),
+		'field_sources': np.array([index[s] if s is not None else -1 for s in field.sources], dtype=np.int64),
+		'field_channels': np.array([c.name for c in field.channels], dtype=str),
+		'field_rows': rows.astype(np.int32),
+		'field_cols': cols.astype(np.int32),
+		'field_strength': field.strength[rows, cols],
+		'blocked': np.flatnonzero(~land.passable).astype(np.int64),
+		'random_buffer': random_buffer,
+		'field_active': occupied,
+		'cell': np.array([l.position.cell for l in entities], dtype=np.int64),
+		'state': np.array([l.state.value for l in entities], dtype=np.int8),
+		'stats': np.array([[l.current_hp, l.max_hp, l.hp_regen, l.attack_strength, l.defense_strength, l.smell_decay_strength]
+							for l in entities], dtype=np.int64).reshape(len(entities), 6),
+		'last_direction': np.array([directions.get(l.last_direction, -1) for l in entities], dtype=np.int8),
+		'hunt_source': np.array([index[h.source] if h is not None else -1 for h in hunt], dtype=np.int64),
+		'hunt_strength': np.array([h.strength if h is not None else 0 for h in hunt], dtype=np.int64),
+	}
+	arrays['path_offsets'], arrays['path'] = ragged([[t.cell for t in l.path] for l in entities])
+	arrays['target_offsets'], arrays['targets'] = ragged([[index[t] for t in l.targets if t in index] for l in entities])
+	damage = [[(index[s], d) for s, d in l.incoming_damage.items() if s in index] for l in entities]
+	arrays['damage_offsets'], arrays['damage_sources'] = ragged([[s for s, d in x] for x in damage])
+	arrays['damage'] = np.array([d for x in damage for s, d in x], dtype=np.int64)
+	return arrays
+
+def write(path:str, arrays:Dict[str, np.ndarray]):
+	# written next to the target and renamed, so a crash never leaves half a checkpoint
+	tmp = path + '.tmp'
+	with open(tmp, 'wb') as f:
+		np.savez(f, **arrays)
+	os.replace(tmp, path)
+
+def save(path:str, land:ld.Land, livings:Iterable[lv.Living]):
+	write(path, snapshot(land, livings))
+
+def load(path:str):
+	# returns the restored (land, livings)
+	with np.load(path, allow_pickle=False) as data:
+		arrays = {k:data[k] for k in data.files}
+	meta = json.loads(str(arrays['meta']))
+	if meta['version'] != Version:
+		raise ValueError('checkpoint version {} is not supported'.format(meta['version']))
+
+	storage = st.Mapped(meta['storage']['directory']) if 'storage' in meta else None
+	land = ld.Land(meta['radius'], meta['screen_size'], meta['terrain_size'], seed=meta['seed'], storage=storage)
+	land.random.set_state(dict(meta['random'], buffer=arrays['random_buffer'].tolist()))
+	land.tick = meta['tick']
+	land.events.tick = land.tick
+	terrains = land.terrains
+	for cell in arrays['blocked'].tolist():
+		land.set_passable(terrains[cell], False)
+
+	livings = []
+	for i, (uid, name) in enumerate(zip(meta['uids'], meta['names'])):
+		l = lv.Living(uid, name, terrains[arrays['cell'][i]])
+		l.state = lv.LivingState(int(arrays['state'][i]))
+		if l.state == lv.LivingState.DEAD:
+			land.remove(l, l.position)
+		l.current_hp, l.max_hp, l.hp_regen, l.attack_strength, l.defense_strength, l.smell_decay_strength = arrays['stats'][i].tolist()
+		direction = int(arrays['last_direction'][i])
+		l.last_direction = pl.Directions[direction] if direction >= 0 else None
+		livings.append(l)
+
+	paths = unragged(arrays['path_offsets'], arrays['path'])
+	targets = unragged(arrays['target_offsets'], arrays['targets'])
+	damage_sources = unragged(arrays['damage_offsets'], arrays['damage_sources'])
+	damage = unragged(arrays['damage_offsets'], arrays['damage'])
+	for i, l in enumerate(livings):
+		l.path = [terrains[c] for c in paths[i]]
+		l.targets = [livings[t] for t in targets[i]]
+		l.incoming_damage = {livings[s]:d for s, d in zip(damage_sources[i], damage[i])}
+		source = int(arrays['hunt_source'][i])
+		l.hunt_smell = lv.Smell(livings[source], int(arrays['hunt_strength'][i])) if source >= 0 else None
+
+	field = land.field
+	for source, channel in zip(arrays['field_sources'].tolist(), arrays['field_channels'].tolist()):
+		field.column(livings[source] if source >= 0 else None, fd.Channels[channel])
+	rows = arrays['field_rows'].astype(np.intp)
+	field.strength[rows, arrays['field_cols']] = arrays['field_strength']
+	field.active = arrays['field_active'].astype(np.intp)
+
+	return land, livings
+
+class Checkpointer:
+	# tick observer that snapshots every 'every' ticks and writes in the background
+	def __init__(self, path:str, every:int):
+		self.path = path
+		self.every = every
+		self.writer = None
+
+	def __repr__(self):
+		return 'Checkpointer(path:{}, every:{})'.format(self.path, self.every)
+
+	def on_tick(self, land:ld.Land, livings:Iterable[lv.Living]):
+		if land.tick % self.every == 0:
+			self.save(land, livings)
+
+	def save(self, land:ld.Land, livings:Iterable[lv.Living]):
+		arrays = snapshot(land, livings)
+		self.wait()
+		self.writer = threading.Thread(target=write, args=(self.path, arrays), daemon=True)
+		self.writer.start()
+
+	def wait(self):
+		if self.writer is not None:
+			self.writer.join()
+			self.writer = None
+
+	def close(self):
+		self.wait()
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_round_trip():
+	import engine as en
+	import tempfile
+	land = ld.Land(6, 800, 20)
+	land.set_passable(land.map[(1, 1)], False)
+	livings = en.populate(land, 8)
+	en.run(land, livings, 5)
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, 'world.npz')
+		checkpointer = Checkpointer(path, every=5)
+		checkpointer.on_tick(land, livings)
+		checkpointer.close()
+		restored_land, restored = load(path)
+
+	equal_int('restored tick', restored_land.tick, land.tick)
+	equal_int('restored passable', (restored_land.passable == land.passable).all(), True)
+	equal_int('restored count', len(restored), len(livings))
+	n = len(land.field.sources)
+	equal_int('restored field', (restored_land.field.strength[:, :n] == land.field.strength[:, :n]).all(), True)
+	for a, b in zip(livings, restored):
+		equal_int('restored uid', a.uid, b.uid)
+		equal_int('restored position', a.position.polygon, b.position.polygon)
+		equal_int('restored state', a.state, b.state)
+		equal_int('restored hp', a.current_hp, b.current_hp)
+		equal_int('restored path', [t.polygon for t in a.path], [t.polygon for t in b.path])
+		equal_int('restored targets', [t.uid for t in a.targets], [t.uid for t in b.targets])
+		equal_int('restored hunt', a.hunt_smell and (a.hunt_smell.source.uid, a.hunt_smell.strength),
+							b.hunt_smell and (b.hunt_smell.source.uid, b.hunt_smell.strength))
+
+	# both worlds carry on identically from the checkpoint, random stream included
+	equal_int('resumed', en.replay([(land, livings), (restored_land, restored)], 10), None)
+
+def test_mapped():
+	import engine as en
+	import tempfile
+	def world(storage:st.Mapped = None):
+		land = ld.Land(8, 800, 20, seed=2, storage=storage)
+		land.set_passable(land.map[(2, -1)], False)
+		livings = en.populate(land, 12)
+		en.run(land, livings, 5)
+		return land, livings
+
+	with tempfile.TemporaryDirectory() as tmp:
+		land, livings = world(st.Mapped(os.path.join(tmp, 'world')))
+		path = os.path.join(tmp, 'world.npz')
+		save(path, land, livings)
+		n = len(land.field.sources)
+		strength = np.array(land.field.strength[:, :n])
+
+		# the world ticks on in the same files; the checkpoint must not follow it
+		land.set_passable(land.map[(0, 1)], False)
+		en.run(land, livings, 3)
+		restored_land, restored = load(path)
+		equal_int('mapped storage', isinstance(restored_land.storage, st.Mapped), True)
+		equal_int('mapped passable', (restored_land.map[(2, -1)].passable, restored_land.map[(0, 1)].passable), (False, True))
+		equal_int('mapped field', (restored_land.field.strength[:, :n] == strength).all(), True)
+		equal_int('mapped resumed', en.replay([world(), (restored_land, restored)], 5), None)
+
+def test_all():
+	test_round_trip()
+	test_mapped()
+
+if __name__ == '__main__':
+	test_all()
@@ -0,0 +1,174 @@
+# every attack of a tick, kept as flat arrays (attacker, target, damage) and
+# resolved for all fighters at once: regen, defense, damage and death in one
+# vectorized pass, however large the battle.
+import hexarray as ha
+import itertools
+import numpy as np
+from typing import List, Tuple
+
+class Attacks:
+	# attacks not yet taken, in the order they were made. A later attack from
+	# the same attacker on the same target replaces the earlier one. New
+	# attacks are appended to a list and moved into the arrays in one go
+	def __init__(self):
+		self.attacker = np.zeros(0, dtype=np.intp)
+		self.target = np.zeros(0, dtype=np.intp)
+		self.damage = np.zeros(0, dtype=np.int64)
+		self.made = [] #List[Tuple[int, int, int]], (attacker, target, damage)
+
+	def __repr__(self):
+		return 'Attacks(pending:{})'.format(len(self))
+
+	def __len__(self):
+		return len(self.target) + len(self.made)
+
+	def add(self, attacker:int, target:int, damage:int):
+		self.made.append((attacker, target, damage))
+
+	def flush(self):
+		if self.made:
+			made = np.fromiter(itertools.chain.from_iterable(self.made), dtype=np.int64, count=3 * len(self.made)).reshape(-1, 3)
+			self.attacker = np.concatenate((self.attacker, made[:, 0]))
+			self.target = np.concatenate((self.target, made[:, 1]))
+			self.damage = np.concatenate((self.damage, made[:, 2]))
+			self.made = []
+
+	def extend(self, attacker:np.ndarray, target:np.ndarray, damage:np.ndarray):
+		# many attacks at once, made after everything already added
+		self.flush()
+		self.attacker = np.concatenate((self.attacker, attacker.astype(np.intp)))
+		self.target = np.concatenate((self.target, target.astype(np.intp)))
+		self.damage = np.concatenate((self.damage, damage.astype(np.int64)))
+
+	def on(self, target:int):
+		# (attacker, damage) of the attacks pending on 'target', later ones last
+		self.flush()
+		i = np.flatnonzero(self.target == target)
+		return list(zip(self.attacker[i].tolist(), self.damage[i].tolist()))
+
+	def keep(self, kept:np.ndarray):
+		# drops every attack not in the boolean mask 'kept', over the flushed arrays
+		self.attacker = self.attacker[kept]
+		self.target = self.target[kept]
+		self.damage = self.damage[kept]
+
+	def take(self, selected:np.ndarray):
+		# removes and returns (target, damage) of every attack on a row where
+		# 'selected' is set, one per attacker and target
+		self.flush()
+		hit = selected[self.target]
+		if not hit.any():
+			return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int64)
+		target = self.target[hit]
+		attacker = self.attacker[hit]
+		damage = self.damage[hit]
+		# the last attack per (attacker, target) pair: first seen when reversed
+		pair = target * len(selected) + attacker
+		unique, first = np.unique(pair[::-1], return_index=True)
+		last = len(pair) - 1 - first
+		self.keep(~hit)
+		return target[last], damage[last]
+
+def strike_adjacent(land:'ld.Land', fighters:List['lv.Living'], dead:int):
+	# the FIGHTING rule for a whole battle at once: a fighter whose prey still
+	# stands next to it hits it. Returns those fighters; the others (prey gone,
+	# dead or out of reach) are left to Living.update_state. 'dead' is the
+	# stored value of LivingState.DEAD
+	store = land.entities
+	prey = [l.targets[0] if l.targets else None for l in fighters]
+	engaged = [(l, p) for l, p in zip(fighters, prey) if p is not None]
+	if not engaged:
+		return []
+	rows = store.rows(l for l, p in engaged)
+	prey_rows = store.rows(p for l, p in engaged)
+	q, r = land.index.coords(store.cell[rows])
+	pq, pr = land.index.coords(store.cell[prey_rows])
+	hits = (ha.distance(q, r, pq, pr) == 1) & (store.seen_state[prey_rows] != dead)
+	store.attacks.extend(rows[hits], prey_rows[hits], store.attack[rows[hits]])
+	return [l for (l, p), hit in zip(engaged, hits.tolist()) if hit]
+
+def resolve(store:'es.EntityStore', rows:np.ndarray):
+	# regenerates 'rows', then takes every attack aimed at them, each reduced
+	# by the target's defense. Returns the rows left without hp
+	rows = np.asarray(rows, dtype=np.intp)
+	hp = np.minimum(store.max_hp[rows], store.hp[rows] + store.regen[rows])
+	if len(store.attacks):
+		selected = np.zeros(store.count, dtype=bool)
+		selected[rows] = True
+		targets, damage = store.attacks.take(selected)
+		if len(targets):
+			actual = np.maximum(damage - store.defense[targets], 0)
+			total = np.bincount(targets, weights=actual, minlength=store.count).astype(np.int64)
+			hp = np.maximum(hp - total[rows], 0)
+	store.hp[rows] = hp
+	return rows[hp <= 0]
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_take():
+	attacks = Attacks()
+	for attacker, target, damage in ((1, 0, 5), (2, 0, 3), (1, 2, 4)):
+		attacks.add(attacker, target, damage)
+	equal_int('attacks on', attacks.on(0), [(1, 5), (2, 3)])
+	attacks.add(1, 0, 7)
+	attacks.add(0, 1, 2)
+	equal_int('attacks pending', len(attacks), 5)
+	equal_int('attacks on', attacks.on(0), [(1, 5), (2, 3), (1, 7)])
+	selected = np.array([True, False, True])
+	targets, damage = attacks.take(selected)
+	equal_int('attacks replaced', sorted(zip(targets.tolist(), damage.tolist())), [(0, 3), (0, 7), (2, 4)])
+	equal_int('attacks pending', (len(attacks), attacks.on(1)), (1, [(0, 2)]))
+
+def test_battle():
+	import land as ld
+	import living as lv
+	land = ld.Land(30, 800, 20)
+	store = land.entities
+	rand = np.random.default_rng(1)
+	fighters = [lv.Living(i, 'Fighter {}'.format(i), land.terrains[int(c)]) for i, c in enumerate(rand.integers(0, len(land.cells), 2000))]
+	for l in fighters:
+		l.defense_strength = int(rand.integers(0, 3))
+	for a, t in rand.integers(0, len(fighters), (6000, 2)).tolist():
+		fighters[t].attack(fighters[a], int(rand.integers(1, 6)))
+
+	# the per-living rule: regen, then each attacker's last hit less defense
+	expected = []
+	for l in fighters:
+		damage = l.incoming_damage
+		hp = min(l.max_hp, l.current_hp + l.hp_regen)
+		expected.append(max(hp - sum(max(d - l.defense_strength, 0) for d in damage.values()), 0))
+
+	dead = resolve(store, store.rows(fighters))
+	equal_int('battle hp', [l.current_hp for l in fighters], expected)
+	equal_int('battle dead', dead.tolist(), [l.row for l, hp in zip(fighters, expected) if hp <= 0])
+	equal_int('battle taken', len(store.attacks), 0)
+
+def test_strike_adjacent():
+	import land as ld
+	import living as lv
+	land = ld.Land(5, 800, 20)
+	a = lv.Living(0, 'A', land.map[(0, 0)])
+	b = lv.Living(1, 'B', land.map[(1, 0)])
+	c = lv.Living(2, 'C', land.map[(3, 0)])
+	for l, target in ((a, b), (b, a), (c, a)):
+		l.set_state(lv.LivingState.FIGHTING, target=target)
+	land.entities.swap()
+	struck = strike_adjacent(land, [a, b, c], lv.LivingState.DEAD.value)
+	equal_int('strike adjacent', struck, [a, b])
+	equal_int('strike damage', (a.incoming_damage, b.incoming_damage, c.incoming_damage), ({b:5}, {a:5}, {}))
+
+def test_all():
+	test_take()
+	test_battle()
+	test_strike_adjacent()
+
+if __name__ == '__main__':
+	test_all()
@@ -0,0 +1,362 @@
+# headless world stepping: nothing in here may import pygame, the renderer
+# lives in simulation.py and is only loaded when asked for
+import land as ld
+import living as lv
+import events as ev
+import combat as cb
+import argparse
+import sys
+import time
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+
+def decay(land:ld.Land, alive:List[lv.Living]):
+	land.field.decay()
+
+def broadcast(land:ld.Land, alive:List[lv.Living]):
+	land.field.broadcast()
+
+def diffuse(land:ld.Land, alive:List[lv.Living]):
+	land.field.diffuse()
+
+def move(land:ld.Land, alive:List[lv.Living]):
+	for l in alive:
+		l.move()
+
+def perceive(land:ld.Land, alive:List[lv.Living]):
+	land.perception.update(alive)
+
+def act(land:ld.Land, alive:List[lv.Living]):
+	# combat for everyone in one pass, then the per-living decisions of those
+	# still standing. Fighters next to their prey strike in one batch too;
+	# every attack is taken on the next tick
+	store = land.entities
+	for row in store.update_hp(store.rows(alive)).tolist():
+		l = store.livings[row]
+		l.set_state(lv.LivingState.DEAD)
+		land.events.info(l.uid, 'died')
+	fighting = [l for l in alive if l.state == lv.LivingState.FIGHTING]
+	struck = set(cb.strike_adjacent(land, fighting, lv.LivingState.DEAD.value))
+	for l in alive:
+		if l.state != lv.LivingState.DEAD and l not in struck:
+			l.update_state()
+			l.update_path()
+	chase(land, [l for l in alive if l.state == lv.LivingState.HUNTING and l not in struck])
+
+def chase(land:ld.Land, hunters:List[lv.Living]):
+	# hunters after the same prey walk down one distance field to it, built once
+	# for the whole pack, instead of each following the scent on its own. The
+	# field only reaches twice as far as the farthest hunter; a lone hunter, or
+	# one with no way through within that, keeps the step it chose
+	packs = {}
+	for l in hunters:
+		packs.setdefault(l.hunt_smell.source, []).append(l)
+	for prey, pack in packs.items():
+		if len(pack) < 2 or prey.state == lv.LivingState.DEAD:
+			continue
+		reach = 2 * max(l.position.polygon.distanceTo(prey.position.polygon) for l in pack)
+		for l in pack:
+			scent_step = l.path
+			l.path_towards([prey.position], steps=1, reach=reach)
+			if not l.path:
+				l.path = scent_step
+
+class Phase(NamedTuple):
+	name: str
+	run: Callable[[ld.Land, List[lv.Living]], None]
+	swaps: Tuple[str, ...] # Land attributes whose buffers are swapped when the phase ends
+
+# a tick runs these in order. Diffusion writes the field's back buffer, and
+# livings see each other's cells and states as of the end of the last phase
+Phases = (
+	Phase('decay', decay, ()),
+	Phase('broadcast', broadcast, ()),
+	Phase('diffuse', diffuse, ('field',)),
+	Phase('move', move, ('entities',)),
+	Phase('perceive', perceive, ()),
+	Phase('act', act, ('entities',)),
+)
+
+def run_phase(land:ld.Land, alive:List[lv.Living], phase:Phase):
+	phase.run(land, alive)
+	for name in phase.swaps:
+		getattr(land, name).swap()
+
+def update_world(land:ld.Land, livings:Iterable[lv.Living], probe:'pr.Probe' = None):
+	land.tick += 1
+	land.events.tick = land.tick
+	alive = [l for l in livings if l.state != lv.LivingState.DEAD]
+	# at most one draw per living and tick, fetched in a single batch
+	land.random.reserve(len(alive))
+	# publishes whatever changed between ticks (new livings, a loaded checkpoint)
+	land.entities.swap()
+	if probe is None:
+		for phase in Phases:
+			run_phase(land, alive, phase)
+		return alive
+
+	field = land.field
+	for phase in Phases:
+		name = phase.name
+		if name == 'diffuse':
+			smells_before = field.count_smells(field.active)
+		start = probe.begin(name)
+		run_phase(land, alive, phase)
+		probe.end(name, start)
+		if name == 'decay':
+			probe.count('cells_decayed', len(field.active))
+		elif name == 'diffuse':
+			probe.count('cells_diffused', len(field.frontier))
+			probe.count('smells_created', field.count_smells(field.active) - smells_before)
+	probe.count('entities_acted', len(alive))
+	probe.end_tick()
+	return alive
+
+def run(land:ld.Land, livings:Iterable[lv.Living], ticks:int, probe:'pr.Probe' = None, observers:Iterable = ()):
+	# steps the world 'ticks' times as fast as possible. Observers get
+	# on_tick(land, livings) after every tick
+	livings = list(livings)
+	observers = list(observers)
+	for i in range(ticks):
+		update_world(land, livings, probe)
+		for observer in observers:
+			observer.on_tick(land, livings)
+	return livings
+
+def default_livings(land:ld.Land):
+	pos1 = land.map[(0, 0)]
+	l1 = lv.Living('Adam', 'Adam', pos1)
+	l1.state = lv.LivingState.SEARCHING
+	p10 = list(l1.position.neighbors.values())[0]
+	p11 = list(p10.neighbors.values())[0]
+	p12 = list(p11.neighbors.values())[0]
+	p13 = list(p12.neighbors.values())[0]
+	l1.path = [p10, p11, p12, p13]
+
+	pos2 = land.terrains[-10]
+	l2 = lv.Living('Eve', 'Eve', pos2)
+
+	pos3 = land.terrains[12]
+	l3 = lv.Living('Plissken', 'Plissken', pos3)
+
+	return [l1, l2, l3]
+
+def populate(land:ld.Land, count:int, state:lv.LivingState = lv.LivingState.SEARCHING):
+	# placed with the land's own random stream, so the seed decides everything
+	livings = []
+	for i in range(count):
+		l = lv.Living(i, 'Living {}'.format(i), land.random.choice(land.terrains))
+		l.state = state
+		livings.append(l)
+	return livings
+
+def parallelize(land:ld.Land, workers:int):
+	# moves the land's field, e.g. one just loaded from a checkpoint, into worker processes
+	import parallel
+	field = parallel.ParallelSmellField(land, workers)
+	field.adopt(land.field)
+	land.attach_field(field)
+	return field
+
+def trajectory(livings:Iterable[lv.Living]):
+	return [(l.uid, l.position.cell, l.state.value, l.current_hp) for l in livings]
+
+def replay(worlds:Iterable['Tuple[ld.Land, List[lv.Living]]'], ticks:int):
+	# steps identically seeded worlds side by side, each possibly on a different
+	# engine (e.g. a parallel smell field), and returns the first tick at which
+	# their livings disagree, or None when the trajectories are identical
+	worlds = [(land, list(livings)) for land, livings in worlds]
+	for tick in range(ticks):
+		for land, livings in worlds:
+			update_world(land, livings)
+		expected = trajectory(worlds[0][1])
+		if any(trajectory(livings) != expected for land, livings in worlds[1:]):
+			return worlds[0][0].tick
+	return None
+
+def main(argv:List[str] = None):
+	parser = argparse.ArgumentParser(description='Run the world without a display.')
+	parser.add_argument('--radius', type=int, default=5, help='land radius in hexes')
+	parser.add_argument('--ticks', type=int, default=100, help='number of ticks to run')
+	parser.add_argument('--population', type=int, default=0, help='random livings to seed instead of the default three')
+	parser.add_argument('--seed', type=int, default=0, help='random seed for placement and movement')
+	parser.add_argument('--workers', type=int, default=0, help='advance smell in this many worker processes')
+	parser.add_argument('--profile', type=int, default=0, help='log phase timings every this many ticks')
+	parser.add_argument('--trace', help='write a Chrome trace of the phases to this file')
+	parser.add_argument('--events', help='write the event log to this JSON Lines file')
+	parser.add_argument('--log-level', default='info', choices=[l.name.lower() for l in ev.Level], help='lowest event level to record')
+	parser.add_argument('--checkpoint', help='write checkpoints of the world to this .npz file')
+	parser.add_argument('--checkpoint-every', type=int, default=1000, help='ticks between checkpoints')
+	parser.add_argument('--resume', help='start from this checkpoint instead of a new world')
+	parser.add_argument('--storage', help='keep the per-cell arrays in memory-mapped files in this directory')
+	parser.add_argument('--metrics', help='stream per-tick statistics to this file')
+	parser.add_argument('--metrics-format', default='csv', choices=['csv', 'npy'], help='a CSV file, or numbered .npy chunks')
+	parser.add_argument('--render', action='store_true', help='open the pygame window instead of running headless')
+	parser.add_argument('--replay', action='store_true', help='run the world twice, the second time with --workers if given, and check both runs match')
+	args = parser.parse_args(argv)
+
+	probe = None
+	if args.profile > 0 or args.trace:
+		import probe as pr
+		probe = pr.Probe(log_every=args.profile, trace=bool(args.trace))
+
+	if args.render:
+		import simulation
+		try:
+			return simulation.main(probe)
+		finally:
+			if args.trace:
+				probe.export_trace(args.trace)
+
+	def world():
+		if args.resume:
+			import checkpoint as cp
+			return cp.load(args.resume)
+		storage = None
+		if args.storage:
+			import storage as st
+			storage = st.Mapped(args.storage)
+		land = ld.Land(args.radius, 800, 20, seed=args.seed, storage=storage)
+		return land, populate(land, args.population) if args.population > 0 else default_livings(land)
+
+	if args.replay:
+		worlds = [world(), world()]
+		if args.workers > 0:
+			parallelize(worlds[1][0], args.workers)
+		try:
+			tick = replay(worlds, args.ticks)
+		finally:
+			if args.workers > 0:
+				worlds[1][0].field.close()
+		print('replay identical for {} ticks'.format(args.ticks) if tick is None else 'replay diverged at tick {}'.format(tick))
+		return tick is None
+
+	land, livings = world()
+	if args.storage or args.resume:
+		# the arrays of earlier runs in the directory, e.g. the one resumed from
+		land.storage.prune()
+
+	observers = []
+	if args.checkpoint:
+		import checkpoint as cp
+		observers.append(cp.Checkpointer(args.checkpoint, args.checkpoint_every))
+	if args.metrics:
+		import metrics as mt
+		dead = sum(1 for l in livings if l.state == lv.LivingState.DEAD)
+		observers.append(mt.MetricsRecorder(args.metrics, args.metrics_format, dead=dead))
+
+	land.events.level = ev.Level[args.log_level.upper()]
+	if args.events:
+		land.events.sink = ev.JsonLinesSink(open(args.events, 'w'))
+
+	if args.workers > 0:
+		parallelize(land, args.workers)
+
+	start = time.perf_counter()
+	try:
+		run(land, livings, args.ticks, probe, observers)
+	finally:
+		for observer in observers:
+			observer.close()
+		if args.workers > 0:
+			land.field.close()
+		land.events.close()
+	elapsed = time.perf_counter() - start
+
+	if args.trace:
+		probe.export_trace(args.trace)
+
+	alive = sum(1 for l in livings if l.state != lv.LivingState.DEAD)
+	print('{} ticks in {:.3f}s ({:.1f} ticks/s), {}/{} alive'.format(args.ticks, elapsed, args.ticks / max(elapsed, 1e-9), alive, len(livings)))
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_run():
+	land = ld.Land(3, 800, 20)
+	livings = [lv.Living(0, 'Test Living', land.map[(0, 0)])]
+	run(land, livings, 3)
+	equal_int('run smell at source', land.map[(0, 0)].smells[livings[0]].strength, 100)
+	equal_int('run smell diffused', land.map[(1, 0)].smells[livings[0]].strength, 80)
+
+def test_probe():
+	import probe as pr
+	land = ld.Land(3, 800, 20)
+	livings = [lv.Living(0, 'Test Living', land.map[(0, 0)])]
+	probe = pr.Probe()
+	run(land, livings, 3, probe)
+	summary = probe.summary()
+	equal_int('probe ticks', summary['ticks'], 3)
+	equal_int('probe phases', sorted(summary['calls']), sorted(phase.name for phase in Phases))
+	equal_int('probe entities', summary['counters']['entities_acted'], 3)
+	# livings emit when they move, after diffusion, so the first tick creates nothing
+	# and the next two spread to the 6 and 12 hexes of the following rings
+	equal_int('probe smells created', summary['counters']['smells_created'], 6 + 12)
+
+def test_events():
+	land = ld.Land(3, 800, 20)
+	hunter = lv.Living(0, 'Hunter', land.map[(0, 0)])
+	hunter.state = lv.LivingState.SEARCHING
+	prey = lv.Living(1, 'Prey', land.map[(1, 0)])
+	run(land, [hunter, prey], 4)
+	scents = land.events.recent('scent')
+	equal_int('events scent', len(scents), 1)
+	if scents:
+		equal_int('events entity', scents[0].entity, 0)
+		equal_int('events payload', scents[0].payload['source'], 1)
+	equal_int('events debug filtered', len(land.events.recent('step')), 0)
+
+def test_default_livings():
+	land = ld.Land(5, 800, 20)
+	livings = default_livings(land)
+	equal_int('default livings', len(livings), 3)
+	equal_int('default path', len(livings[0].path), 4)
+
+def test_chase():
+	land = ld.Land(5, 800, 20)
+	prey = lv.Living(0, 'Prey', land.map[(0, 0)])
+	hunters = [lv.Living(i, 'Hunter {}'.format(i), land.map[qr]) for i, qr in enumerate(((3, 0), (-3, 1), (0, -4)), 1)]
+	for h in hunters:
+		h.set_state(lv.LivingState.HUNTING, lv.Smell(prey, 1))
+		h.path = []
+	loner = lv.Living(4, 'Loner', land.map[(4, -1)])
+	other = lv.Living(5, 'Other', land.map[(-4, 0)])
+	loner.set_state(lv.LivingState.HUNTING, lv.Smell(other, 1))
+	loner.path = []
+	chase(land, hunters + [loner])
+	equal_int('chase shared field', len(land.paths.fields), 1)
+	equal_int('chase closer', [h.path[0].polygon.distanceTo(prey.position.polygon) for h in hunters], [2, 2, 3])
+	equal_int('chase loner', loner.path, [])
+
+def test_replay():
+	import parallel
+	def world():
+		land = ld.Land(6, 800, 20, seed=3)
+		return land, populate(land, 12)
+	equal_int('replay same engine', replay([world(), world()], 30), None)
+	parallel_world = world()
+	with parallel.ParallelSmellField(parallel_world[0], 2) as field:
+		parallel_world[0].attach_field(field)
+		equal_int('replay parallel engine', replay([world(), parallel_world], 15), None)
+
+	other = ld.Land(6, 800, 20, seed=4)
+	diverged = replay([world(), (other, populate(other, 12))], 30)
+	equal_int('replay other seed', diverged, 1)
+
+def test_all():
+	test_run()
+	test_probe()
+	test_events()
+	test_default_livings()
+	test_chase()
+	test_replay()
+
+if __name__ == '__main__':
+	# a diverged --replay exits with status 1
+	sys.exit(0 if main() is not False else 1)
@@ -0,0 +1,147 @@
+# the numbers behind every Living of a world, kept as parallel arrays indexed
+# by row. Living objects are thin views onto their row, and hp is advanced
+# for all of them in one vectorized pass.
+import buffer as bf
+import combat as cb
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+
+Columns = ('hp', 'max_hp', 'regen', 'attack', 'defense')
+
+# what livings read of each other: written by a phase, seen by others once it ends
+Buffered = ('cell', 'state')
+
+class EntityStore:
+	def __init__(self, capacity:int = 64):
+		self.count = 0
+		self.livings = [] #List[Living], by row
+		self.buffers = {
+			'cell': bf.DoubleBuffer(np.full(capacity, -1, dtype=np.int64)), #-1 when not on a Land
+			'state': bf.DoubleBuffer(np.zeros(capacity, dtype=np.int8)), #LivingState values
+		}
+		self.hp = np.zeros(capacity, dtype=np.int32)
+		self.max_hp = np.zeros(capacity, dtype=np.int32)
+		self.regen = np.zeros(capacity, dtype=np.int32)
+		self.attack = np.zeros(capacity, dtype=np.int32)
+		self.defense = np.zeros(capacity, dtype=np.int32)
+
+		# attacks not yet taken, by attacker and target row
+		self.attacks = cb.Attacks()
+
+	def __repr__(self):
+		return 'EntityStore(entities:{}, pending attacks:{})'.format(self.count, len(self.attacks))
+
+	def __len__(self):
+		return self.count
+
+	@property
+	def cell(self):
+		return self.buffers['cell'].write
+
+	@property
+	def state(self):
+		return self.buffers['state'].write
+
+	@property
+	def seen_cell(self):
+		return self.buffers['cell'].read
+
+	@property
+	def seen_state(self):
+		return self.buffers['state'].read
+
+	def swap(self):
+		for buffer in self.buffers.values():
+			buffer.swap()
+			buffer.sync()
+
+	def grow(self, capacity:int):
+		def grown(old:np.ndarray, fill:int = 0):
+			new = np.full(capacity, fill, dtype=old.dtype)
+			new[:len(old)] = old
+			return new
+
+		for name in Columns:
+			setattr(self, name, grown(getattr(self, name)))
+		for name, buffer in self.buffers.items():
+			fill = -1 if name == 'cell' else 0
+			self.buffers[name] = bf.DoubleBuffer(grown(buffer.read, fill), grown(buffer.write, fill))
+
+	def add(self, living:'lv.Living'):
+		row = self.count
+		if row == len(self.hp):
+			self.grow(2 * row)
+		self.count += 1
+		self.livings.append(living)
+		return row
+
+	def rows(self, livings:Iterable['lv.Living']):
+		return np.fromiter((l.row for l in livings), dtype=np.intp)
+
+	def strike(self, target:int, source:int, damage:int):
+		self.attacks.add(source, target, damage)
+
+	def damage_to(self, target:int):
+		# later attacks from the same source replace earlier ones
+		return {self.livings[s]:d for s, d in self.attacks.on(target)}
+
+	def set_damage_to(self, target:int, damage:Dict['lv.Living', int]):
+		self.attacks.flush()
+		self.attacks.keep(self.attacks.target != target)
+		for source, d in damage.items():
+			self.attacks.add(source.row, target, d)
+
+	def update_hp(self, rows:np.ndarray):
+		# regenerates 'rows', then takes every attack aimed at them, each
+		# reduced by the target's defense. Attacks on other rows stay pending.
+		# Returns the rows left without hp, see combat.resolve
+		return cb.resolve(self, rows)
+
+# for livings that are not placed on a Land
+unplaced = EntityStore()
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_update_hp():
+	import land as ld
+	import living as lv
+	land = ld.Land(3, 800, 20)
+	livings = [lv.Living(i, 'Test Living {}'.format(i), land.map[(0, 0)]) for i in range(100)]
+	store = land.entities
+	equal_int('store rows', [l.row for l in livings], list(range(100)))
+	equal_int('store grows', len(store.hp) >= 100, True)
+
+	a, b, c = livings[:3]
+	a.current_hp = 4
+	b.defense_strength = 2
+	# x.attack(source, damage) is x being hit
+	a.attack(b, 5)
+	a.attack(c, 3)
+	b.attack(a, 3)
+	c.attack(a, 3)
+	a.attack(c, 6) # replaces c's earlier attack
+	store.update_hp(store.rows([a, b]))
+	equal_int('hp damaged', a.current_hp, 0) # 4 + 1, then - 5 - 6
+	equal_int('hp defended', b.current_hp, 9) # capped at 10, then - (3 - 2)
+	equal_int('hp pending', c.incoming_damage, {a:3})
+	equal_int('hp untouched', livings[3].current_hp, 10)
+
+	reference = lv.Living(100, 'Reference', land.map[(0, 0)])
+	reference.current_hp = 7
+	reference.incoming_damage = {a:4, b:1}
+	reference.update_hp()
+	equal_int('hp single', reference.current_hp, 3)
+
+def test_all():
+	test_update_hp()
+
+if __name__ == '__main__':
+	test_all()
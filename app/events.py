@@ -0,0 +1,129 @@
+# structured event log: entities report what happens to them as events kept
+# in an in-memory ring buffer, optionally batched out to a JSON Lines file
+import collections
+import json
+from enum import IntEnum
+from typing import Any, Dict, NamedTuple, TextIO
+
+class Level(IntEnum):
+	DEBUG = 10
+	INFO = 20
+	WARNING = 30
+
+class Event(NamedTuple):
+	tick: int
+	entity: Any
+	kind: str
+	level: Level
+	payload: Dict[str, Any]
+
+	def __str__(self):
+		return '[{}] {} {} {}'.format(self.tick, self.entity, self.kind, self.payload)
+
+	def to_json(self):
+		return json.dumps({'tick': self.tick, 'entity': self.entity, 'kind': self.kind,
+						'level': self.level.name, **self.payload}, default=str)
+
+class JsonLinesSink:
+	# collects events and writes them in batches of 'batch' lines
+	def __init__(self, f:TextIO, batch:int = 1024):
+		self.f = f
+		self.batch = batch
+		self.pending = []
+
+	def write(self, event:Event):
+		self.pending.append(event)
+		if len(self.pending) >= self.batch:
+			self.flush()
+
+	def flush(self):
+		if self.pending:
+			self.f.write(''.join(e.to_json() + '\n' for e in self.pending))
+			self.pending = []
+		self.f.flush()
+
+	def close(self):
+		self.flush()
+		self.f.close()
+
+class EventLog:
+	def __init__(self, level:Level = Level.INFO, capacity:int = 10000, sink:JsonLinesSink = None):
+		self.tick = 0
+		self.level = level
+		self.buffer = collections.deque(maxlen=capacity)
+		self.sink = sink
+
+	def __repr__(self):
+		return 'EventLog(level:{}, events:{})'.format(self.level.name, len(self.buffer))
+
+	def enabled(self, level:Level):
+		return level >= self.level
+
+	def emit(self, level:Level, entity:Any, kind:str, **payload:Any):
+		if level < self.level:
+			return
+		event = Event(self.tick, entity, kind, level, payload)
+		self.buffer.append(event)
+		if self.sink is not None:
+			self.sink.write(event)
+
+	def debug(self, entity:Any, kind:str, **payload:Any):
+		self.emit(Level.DEBUG, entity, kind, **payload)
+
+	def info(self, entity:Any, kind:str, **payload:Any):
+		self.emit(Level.INFO, entity, kind, **payload)
+
+	def warning(self, entity:Any, kind:str, **payload:Any):
+		self.emit(Level.WARNING, entity, kind, **payload)
+
+	def recent(self, kind:str = None):
+		return [e for e in self.buffer if kind is None or e.kind == kind]
+
+	def flush(self):
+		if self.sink is not None:
+			self.sink.flush()
+
+	def close(self):
+		if self.sink is not None:
+			self.sink.close()
+
+# for livings that are not placed on a Land
+null_log = EventLog(level=Level.WARNING + 1, capacity=0)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_event_log():
+	log = EventLog(capacity=3)
+	log.debug(0, 'ignored')
+	for i in range(5):
+		log.tick = i
+		log.info(i, 'moved', to=[i, -i])
+	equal_int('log filtered', len(log.recent('ignored')), 0)
+	equal_int('log ring buffer', [e.tick for e in log.recent()], [2, 3, 4])
+
+def test_json_lines_sink():
+	import io
+	f = io.StringIO()
+	sink = JsonLinesSink(f, batch=2)
+	log = EventLog(sink=sink)
+	log.info('Adam', 'died')
+	equal_int('sink batched', f.getvalue(), '')
+	log.info('Eve', 'killed', target='Adam')
+	lines = f.getvalue().splitlines()
+	equal_int('sink lines', len(lines), 2)
+	equal_int('sink payload', json.loads(lines[1])['target'], 'Adam')
+
+def test_all():
+	test_event_log()
+	test_json_lines_sink()
+
+if __name__ == '__main__':
+	test_all()
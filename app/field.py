@@ -0,0 +1,341 @@
+import living as lv
+import buffer as bf
+import numpy as np
+import collections.abc
+from typing import Any, Iterator, NamedTuple
+
+class Channel(NamedTuple):
+	# a kind of signal spreading over the land. Scent lingers, spreads at full
+	# strength and tells who left it; sound and light fade with every hex they
+	# travel and share a single column, so any number of emitters costs one.
+	name: str
+	decay: int # strength lost per tick, None for the source's own smell_decay_strength
+	attenuation: int # strength lost per hex
+	per_source: bool
+
+Scent = Channel('scent', None, 0, True)
+Sound = Channel('sound', 50, 20, False)
+Light = Channel('light', 20, 10, False)
+
+Channels = {c.name:c for c in (Scent, Sound, Light)}
+
+class SmellField:
+	# signal strengths of every source on every terrain of a Land, stored as a
+	# dense (cells x columns) array with one column per (channel, source).
+	# Row 'size' is a padding row that always stays empty, so missing
+	# neighbors can be gathered like any other cell. All channels advance
+	# together: decay and attenuation are per-column vectors, not loops.
+	def __init__(self, land:'ld.Land', capacity:int = 8):
+		self.size = len(land.cells)
+		self.neighbors_of = land.neighbors_of
+		self.storage = land.storage
+
+		self.sources = [] #List[Living], indexed by column, None for shared channels
+		self.channels = [] #List[Channel], indexed by column
+		self.columns = {} #Dict[Living, Channel or (Channel, Living), int], scent keyed by the source alone
+		self.decay_rates = np.zeros(capacity, dtype=np.int32)
+		self.attenuation = np.zeros(capacity, dtype=np.int32)
+		self.strength = self.storage.array('strength', (self.size + 1, capacity), np.int32)
+
+		# only cells holding smell (and their neighbors) are processed on a tick
+		self.active = np.zeros(0, dtype=np.intp) #cells that held smell after the last tick
+		self.frontier = np.zeros(0, dtype=np.intp) #cells that can receive smell this tick
+		self.touched = set() #cells emitted into since the last tick
+		self.written = np.zeros(0, dtype=np.intp) #rows the write buffer holds from its last diffusion
+		self.in_frontier = np.zeros(self.size, dtype=bool) #scratch mask, all False between calls
+
+	def __repr__(self):
+		return 'SmellField(cells:{}, sources:{})'.format(self.size, len(self.sources))
+
+	def __str__(self):
+		return repr(self)
+
+	@property
+	def strength(self):
+		# the read buffer: emission and decay work on it row by row in place,
+		# diffusion reads it and writes the other buffer
+		return self.buffer.read
+
+	@strength.setter
+	def strength(self, strength:np.ndarray):
+		if hasattr(self, 'buffer'):
+			for half in (self.buffer.read, self.buffer.write):
+				if half is not strength:
+					self.storage.release(half)
+		self.buffer = bf.DoubleBuffer(strength, self.storage.array('strength', strength.shape, strength.dtype))
+		self.written = np.zeros(0, dtype=np.intp)
+
+	def release(self):
+		# hands both buffers back to the storage, once the field is replaced
+		for half in (self.buffer.read, self.buffer.write):
+			self.storage.release(half)
+
+	def adopt(self, other:'SmellField'):
+		# takes over another field's columns and signal, e.g. one restored from
+		# a checkpoint before a different field implementation is attached
+		for source, channel in zip(other.sources, other.channels):
+			self.column(source, channel)
+		rows = other.occupied()
+		n = len(other.sources)
+		self.strength[rows, :n] = other.strength[rows, :n]
+		self.active = rows
+
+	def key(self, source:'lv.Living', channel:Channel):
+		if channel is Scent:
+			return source
+		return (channel, source) if channel.per_source else channel
+
+	def column(self, source:'lv.Living', channel:Channel = Scent):
+		key = self.key(source, channel)
+		if key in self.columns:
+			return self.columns[key]
+
+		col = len(self.sources)
+		if col == self.strength.shape[1]:
+			self.grow(2 * col)
+		self.sources.append(source if channel.per_source else None)
+		self.channels.append(channel)
+		self.columns[key] = col
+		self.decay_rates[col] = source.smell_decay_strength if channel.decay is None else channel.decay
+		self.attenuation[col] = channel.attenuation
+		return col
+
+	def occupied(self):
+		# every row that can hold a signal right now; all others are zero
+		touched = np.fromiter(self.touched, dtype=np.intp, count=len(self.touched))
+		return np.union1d(self.active, touched)
+
+	def grow(self, capacity:int):
+		# only occupied rows are copied, so the pages of an empty region of a
+		# huge land are never touched
+		strength = self.storage.array('strength', (self.size + 1, capacity), np.int32)
+		rows = self.occupied()
+		strength[rows, :self.strength.shape[1]] = self.strength[rows]
+		decay_rates = np.zeros(capacity, dtype=np.int32)
+		decay_rates[:self.decay_rates.shape[0]] = self.decay_rates
+		attenuation = np.zeros(capacity, dtype=np.int32)
+		attenuation[:self.attenuation.shape[0]] = self.attenuation
+		self.strength = strength
+		self.decay_rates = decay_rates
+		self.attenuation = attenuation
+
+	def emit(self, cell:int, source:'lv.Living', strength:int, channel:Channel = Scent):
+		col = self.column(source, channel)
+		if channel is Scent:
+			self.strength[cell, col] = strength
+		else: # several noises on one hex: the loudest is heard
+			self.strength[cell, col] = max(self.strength[cell, col], strength)
+		self.touched.add(cell)
+
+	def signal_at(self, cell:int, channel:Channel, source:'lv.Living' = None):
+		col = self.columns.get(self.key(source, channel))
+		return int(self.strength[cell, col]) if col is not None else 0
+
+	def decay(self):
+		if self.touched:
+			touched = np.fromiter(self.touched, dtype=np.intp, count=len(self.touched))
+			self.active = np.union1d(self.active, touched)
+			self.touched.clear()
+
+		n = len(self.sources)
+		rows = self.active
+		self.strength[rows, :n] = np.maximum(self.strength[rows, :n] - self.decay_rates[:n], 0)
+
+	def broadcast(self):
+		# smell only reaches active cells and their neighbors
+		frontier = np.union1d(self.active, self.neighbors_of(self.active).ravel())
+		self.frontier = frontier[frontier < self.size]
+
+	def diffuse(self):
+		# every frontier cell takes the strongest of its own and its neighbors'
+		# signals, the neighbors' weakened by each column's attenuation
+		s = self.strength
+		n = len(self.sources)
+		frontier = self.frontier
+		neighbors = self.neighbors_of(frontier)
+		updated = s[frontier, :n]
+		attenuate(updated, s, neighbors, self.attenuation[:n])
+		# everything outside the frontier is empty; so is the write buffer, once
+		# the rows it was last written on are cleared
+		back = self.buffer.write
+		self.in_frontier[frontier] = True
+		back[self.written[~self.in_frontier[self.written]], :n] = 0
+		self.in_frontier[frontier] = False
+		back[frontier, :n] = updated
+		self.written = frontier
+		self.active = frontier[updated.any(axis=1)]
+
+	def swap(self):
+		self.buffer.swap()
+
+	def count_smells(self, rows:np.ndarray):
+		return int(np.count_nonzero(self.strength[rows, :len(self.sources)]))
+
+	def step(self):
+		self.decay()
+		self.broadcast()
+		self.diffuse()
+		self.swap()
+
+	def smells_at(self, cell:int):
+		return SmellView(self, cell)
+
+def attenuate(updated:np.ndarray, s:np.ndarray, neighbors:np.ndarray, attenuation:np.ndarray):
+	# updated = max(own, strongest neighbor - attenuation), in place. Only the
+	# few attenuated columns pay for the subtraction: max(own, max(own, n) - a)
+	# is the same thing, since own - a never beats own.
+	n = len(attenuation)
+	attenuated = np.flatnonzero(attenuation)
+	own = updated[:, attenuated]
+	for direction in range(neighbors.shape[1]):
+		np.maximum(updated, s[neighbors[:, direction], :n], out=updated)
+	if len(attenuated):
+		updated[:, attenuated] = np.maximum(own, updated[:, attenuated] - attenuation[attenuated])
+
+class SmellView(collections.abc.MutableMapping):
+	# dict-like access to the smells of a single terrain, as Terrain.smells
+	def __init__(self, field:SmellField, cell:int):
+		self.field = field
+		self.cell = cell
+
+	def __repr__(self):
+		return 'SmellView(cell:{}, smells:{})'.format(self.cell, len(self))
+
+	def __getitem__(self, source:'lv.Living'):
+		col = self.field.columns.get(source)
+		if col is None:
+			raise KeyError(source)
+		strength = int(self.field.strength[self.cell, col])
+		if strength <= 0:
+			raise KeyError(source)
+		return lv.Smell(source, strength)
+
+	def __contains__(self, source:Any):
+		col = self.field.columns.get(source)
+		return col is not None and self.field.strength[self.cell, col] > 0
+
+	def __setitem__(self, source:'lv.Living', smell:'lv.Smell'):
+		self.field.emit(self.cell, source, smell.strength)
+
+	def __delitem__(self, source:'lv.Living'):
+		if source not in self:
+			raise KeyError(source)
+		self.field.strength[self.cell, self.field.columns[source]] = 0
+
+	def __iter__(self) -> Iterator['lv.Living']:
+		# only scent: other channels are read through SmellField.signal_at
+		row = self.field.strength[self.cell, :len(self.field.sources)]
+		for col in np.flatnonzero(row > 0):
+			if self.field.channels[col] is Scent:
+				yield self.field.sources[col]
+
+	def __len__(self):
+		return sum(1 for source in self)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def reference_step(land:'ld.Land', smells:dict):
+	# the Terrain.decay / broadcast / update_smells rule, on plain dicts
+	decayed = {}
+	for t, t_smells in smells.items():
+		decayed[t] = {k:v - k.smell_decay_strength for (k, v) in t_smells.items() if v - k.smell_decay_strength > 0}
+	updated = {}
+	for t in land.map.values():
+		t_smells = dict(decayed.get(t, {}))
+		for n in t.neighbors.values():
+			for k, v in decayed.get(n, {}).items():
+				t_smells[k] = max(t_smells.get(k, 0), v)
+		if t_smells:
+			updated[t] = t_smells
+	return updated
+
+def test_smell_view():
+	import land as ld
+	land = ld.Land(2, 800, 20)
+	t = land.map[(0, 0)]
+	l = lv.Living(0, 'Test Living', t)
+	equal_int('view empty', len(t.smells), 0)
+	t.smells[l] = lv.Smell(l, 100)
+	equal_int('view set', t.smells[l].strength, 100)
+	equal_int('view len', len(t.smells), 1)
+	equal_int('view contains', l in t.smells, True)
+	equal_int('view other cell', l in land.map[(1, 0)].smells, False)
+	del t.smells[l]
+	equal_int('view delete', l in t.smells, False)
+
+def test_field_matches_terrain_rule():
+	import land as ld
+	import random
+	rand = random.Random(0)
+	land = ld.Land(4, 800, 20)
+	terrains = list(land.map.values())
+	livings = [lv.Living(i, 'Test Living {}'.format(i), rand.choice(terrains)) for i in range(12)]
+	for i, l in enumerate(livings):
+		l.smell_decay_strength = 10 + 5 * (i % 3)
+
+	smells = {}
+	for tick in range(10):
+		for l in livings:
+			l.position = rand.choice(terrains)
+			l.position.smells[l] = l.generateSmell()
+			smells.setdefault(l.position, {})[l] = 100
+		land.field.step()
+		smells = reference_step(land, smells)
+
+		for t in terrains:
+			expected = smells.get(t, {})
+			equal_int('field smell count', len(t.smells), len(expected))
+			for k, v in expected.items():
+				equal_int('field smell strength', t.smells[k].strength, v)
+
+def test_active_region():
+	import land as ld
+	land = ld.Land(20, 800, 20)
+	l = lv.Living(0, 'Test Living', land.map[(0, 0)])
+	for tick in range(10):
+		l.position.smells[l] = l.generateSmell()
+		land.field.step()
+	# strength 100 decaying by 20 reaches 4 hexes: 1 + 6 + 12 + 18 + 24 cells
+	equal_int('active cells', len(land.field.active), 61)
+
+def test_channels():
+	import land as ld
+	land = ld.Land(20, 800, 20)
+	l = lv.Living(0, 'Test Living', land.map[(0, 0)])
+	field = land.field
+	field.emit(l.position.cell, l, 100, Sound)
+	field.emit(l.position.cell, l, 100, Light)
+	l.position.smells[l] = l.generateSmell()
+	other = lv.Living(1, 'Other Living', land.map[(0, 0)])
+	field.emit(other.position.cell, other, 50, Sound)
+	equal_int('shared columns', len(field.sources), 3)
+	field.step()
+	equal_int('scent only in view', list(land.map[(1, 0)].smells), [l])
+
+	# one tick: decayed once, then one hex away loses the channel's attenuation
+	neighbor = land.map[(1, 0)].cell
+	equal_int('scent spreads', land.map[(1, 0)].smells[l].strength, 80)
+	equal_int('sound attenuated', field.signal_at(neighbor, Sound), 100 - Sound.decay - Sound.attenuation)
+	equal_int('light attenuated', field.signal_at(neighbor, Light), 100 - Light.decay - Light.attenuation)
+
+	for tick in range(3):
+		field.step()
+	equal_int('sound fades', field.signal_at(l.position.cell, Sound), 0)
+	equal_int('scent lingers', l in l.position.smells, True)
+
+def test_all():
+	test_smell_view()
+	test_field_matches_terrain_rule()
+	test_active_region()
+	test_channels()
+
+if __name__ == '__main__':
+	test_all()
@@ -4,12 +4,25 @@ import math
 from typing import List, Callable, Any, Iterable
 
 class Hex:
+	__slots__ = ('q', 'r', 's', '_hash')
+
 	def __init__(self, q:int, r:int, s:int):
 		assert type(q) is int and type(r) is int and type(s) is int, 'Hex coordinates must be integers'
 		assert q + r + s == 0, 'q({})+ r({}) + s({}) must be 0'.format(q, r, s)
 		self.q = q
 		self.r = r
 		self.s = s
+		self._hash = hash((q, r))
+
+	@classmethod
+	def unchecked(cls, q:int, r:int, s:int):
+		# skips the validation asserts, for hot paths whose inputs are already valid Hexes
+		h = object.__new__(cls)
+		h.q = q
+		h.r = r
+		h.s = s
+		h._hash = hash((q, r))
+		return h
 	
 	def __repr__(self):
 		return 'Hex(q:{}, r:{})'.format(self.q, self.r)
@@ -18,9 +31,11 @@ class Hex:
 		return '({}, {})'.format(self.q, self.r)
 
 	def __hash__(self):
-		return hash((self.q, self.r))
+		return self._hash
 
 	def __eq__(self, other:Any):
+		if other is self:
+			return True
 		if (isinstance(other, Hex)):
 			return (self.q, self.r) == (other.q, other.r)
 		else:
@@ -28,18 +43,18 @@ class Hex:
 
 	def __add__(self, val:'Hex'):
 		assert(type(val) is Hex), 'cannot add {} to Hex'.format(type(val))
-		return Hex(self.q + val.q, self.r + val.r, self.s + val.s)
+		return Hex.unchecked(self.q + val.q, self.r + val.r, self.s + val.s)
 	
 	def __sub__(self, val:'Hex'):
 		assert(type(val) is Hex), 'cannot subtract {} from Hex'.format(type(val))
-		return Hex(self.q - val.q, self.r - val.r, self.s - val.s)
+		return Hex.unchecked(self.q - val.q, self.r - val.r, self.s - val.s)
 
 	def __mul__(self, val:int):
 		assert(type(val) is int), 'cannot multiple Hex by {}'.format(type(val))
-		return Hex(self.q * val, self.r * val, self.s * val)
+		return Hex.unchecked(self.q * val, self.r * val, self.s * val)
 	
 	def rotate_right(self):
-		return Hex(-self.r, -self.s, -self.q)
+		return Hex.unchecked(-self.r, -self.s, -self.q)
 
 	def __rshift__(self, val:int):
 		# rotates Hex to the right 'val' ammount of times
@@ -50,7 +65,7 @@ class Hex:
 		return h
 	
 	def rotate_left(self):
-		return Hex(-self.s, -self.q, -self.r)
+		return Hex.unchecked(-self.s, -self.q, -self.r)
 
 	def __lshift__(self, val:int):
 		# rotates Hex to the left 'val' ammount of times
@@ -75,7 +90,7 @@ class Hex:
 
 	def distanceTo(self, target:'Hex'):
 		assert(type(target) is Hex), 'cannot calculate a distance between Hex and {}'.format(type(target))
-		return (self - target).length()
+		return (abs(self.q - target.q) + abs(self.r - target.r) + abs(self.s - target.s)) // 2
 
 class FractionalHex:
 	def __init__(self, q:float, r:float, s:float):
@@ -105,20 +120,87 @@ class FractionalHex:
 				si = -qi - ri
 		return Hex(qi, ri, si)
 
+class LRU:
+	# a bounded memo. Counts hits and misses, so its size can be chosen from a real run
+	def __init__(self, maxsize:int = 1024):
+		self.maxsize = maxsize
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __repr__(self):
+		return 'LRU(size:{}/{}, hits:{}, misses:{})'.format(len(self.entries), self.maxsize, self.hits, self.misses)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key:Any, compute:Callable[[], Any]):
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+		value = compute()
+		self.entries[key] = value
+		if len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+		return value
+
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+
 Directions = (Hex(1, 0, -1), Hex(1, -1, 0), Hex(0, -1, 1), Hex(-1, 0, 1), Hex(-1, 1, 0), Hex(0, 1, -1))
 Diagonals = (Hex(2, -1, -1), Hex(1, -2, 1), Hex(-1, -1, 2), Hex(-2, 1, 1), Hex(-1, 2, -1), Hex(1, 1, -2))
 
 def hex_lerp(a:Hex, b:Hex, t:float):
 	return FractionalHex(a.q * (1.0 - t) + b.q * t, a.r * (1.0 - t) + b.r * t, a.s * (1.0 - t) + b.s * t)
 
-def draw_hex_line(a:Hex, b:Hex):
-	dist = a.distanceTo(b)
+def line_offsets(dq:int, dr:int):
+	# draw_hex_line from the origin, which every line is a translation of
+	a = Hex.unchecked(0, 0, 0)
+	b = Hex.unchecked(dq, dr, -dq - dr)
+	dist = b.length()
 	a_nudged = FractionalHex(a.q + 1e-06, a.r + 1e-06, a.s - 2e-06)
 	b_nudged = FractionalHex(b.q + 1e-06, b.r + 1e-06, b.s - 2e-06)
 	results = []
 	step = 1.0 / max(dist, 1)
 	for i in range(dist + 1):
 		results.append(hex_lerp(a_nudged, b_nudged, step * i).round())
+	return tuple(results)
+
+def ring_offsets(radius:int):
+	# hex_ring around the origin, which every ring is a translation of
+	if radius == 0:
+		return (Hex.unchecked(0, 0, 0),)
+	results = []
+	h = Directions[4] * radius
+	for direction in range(6):
+		for i in range(radius):
+			results.append(h)
+			h = h.neighbor(direction)
+	return tuple(results)
+
+# lines and rings by relative offset, shared by every center they are drawn around
+line_cache = LRU(4096)
+ring_cache = LRU(64)
+
+def draw_hex_line(a:Hex, b:Hex):
+	dq, dr = b.q - a.q, b.r - a.r
+	offsets = line_cache.get((dq, dr), lambda: line_offsets(dq, dr))
+	return [Hex.unchecked(a.q + o.q, a.r + o.r, a.s + o.s) for o in offsets]
+
+def hex_ring(center:Hex, radius:int):
+	# hexes exactly 'radius' steps from center, walking around from direction 4
+	offsets = ring_cache.get(radius, lambda: ring_offsets(radius))
+	return [Hex.unchecked(center.q + o.q, center.r + o.r, center.s + o.s) for o in offsets]
+
+def hex_spiral(center:Hex, radius:int):
+	# hexes up to 'radius' steps from center, ring by ring
+	results = [center]
+	for k in range(1, radius + 1):
+		results.extend(hex_ring(center, k))
 	return results
 
 Orientation = collections.namedtuple("Orientation", ["f0", "f1", "f2", "f3", "b0", "b1", "b2", "b3", "start_angle"])
@@ -155,18 +237,46 @@ def hex_corner_offset(layout:Layout, corner:int):
 def polygon_corners(layout:Layout, h:Hex):
 	corners = []
 	center = hex_to_pixel(layout, h)
-	for i in range(0, 6):
-		offset = hex_corner_offset(layout, i)
+	for offset in geometry(layout).corners:
 		corners.append(Point(center.x + offset.x, center.y + offset.y))
 	return corners
 
+class GeometryCache:
+	# the pixel geometry of one Layout: its six corner offsets, computed once,
+	# and the centers and polygons of recently drawn hexes
+	def __init__(self, layout:Layout, maxsize:int = 1 << 16):
+		self.layout = layout
+		self.corners = tuple(hex_corner_offset(layout, i) for i in range(6))
+		self.centers = LRU(maxsize)
+		self.polygons = LRU(maxsize)
+
+	def __repr__(self):
+		return 'GeometryCache(centers:{}, polygons:{})'.format(self.centers, self.polygons)
+
+	def hex_to_pixel(self, h:Hex):
+		return self.centers.get(h, lambda: hex_to_pixel(self.layout, h))
+
+	def polygon_corners(self, h:Hex):
+		# shared between callers, so a tuple rather than polygon_corners' list
+		def compute():
+			center = self.hex_to_pixel(h)
+			return tuple(Point(center.x + o.x, center.y + o.y) for o in self.corners)
+		return self.polygons.get(h, compute)
+
+geometries = {} #Dict[Layout, GeometryCache]
+
+def geometry(layout:Layout):
+	if layout not in geometries:
+		geometries[layout] = GeometryCache(layout)
+	return geometries[layout]
+
 def generate_hex_map(radius:int):
 	hex_map = {}
 	for q in range(-radius, radius + 1):
 		ri = max(-radius, -q - radius)
 		rf = min(radius, -q + radius)
 		for r in range(ri, rf + 1):
-			hex_map[Hex(q, r, -q - r)] = ''
+			hex_map[Hex.unchecked(q, r, -q - r)] = ''
 	return hex_map
 
 
@@ -230,6 +340,42 @@ def test_layout():
 	pointy = Layout(layout_pointy, Point(10.0, 15.0), Point(35.0, 71.0))
 	equal_hex("layout", h, pixel_to_hex(pointy, hex_to_pixel(pointy, h)))
 
+def test_hex_unchecked():
+	equal_hex("hex_unchecked", Hex(1, -3, 2), Hex.unchecked(1, -3, 2))
+	equal_int("hex_unchecked hash", hash(Hex(1, -3, 2)), hash(Hex.unchecked(1, -3, 2)))
+	equal_int("hex_unchecked eq", Hex(1, -3, 2) == Hex.unchecked(1, -3, 2), True)
+
+def test_caches():
+	equal_hex_array("line cached", draw_hex_line(Hex(4, 2, -6), Hex(5, -3, -2)), draw_hex_line(Hex(4, 2, -6), Hex(5, -3, -2)))
+	hits = line_cache.hits
+	equal_hex_array("line translated", [h + Hex(3, 8, -11) for h in draw_hex_line(Hex(0, 0, 0), Hex(1, -5, 4))], draw_hex_line(Hex(3, 8, -11), Hex(4, 3, -7)))
+	equal_int("line hit", line_cache.hits >= hits + 1, True)
+	small = LRU(2)
+	for key in (1, 2, 1, 3, 2):
+		small.get(key, lambda: key * 10)
+	equal_int("lru bounded", list(small.entries), [3, 2])
+	equal_int("lru counters", (small.hits, small.misses), (1, 4))
+
+	pointy = Layout(layout_pointy, Point(10.0, 15.0), Point(35.0, 71.0))
+	equal_int("geometry per layout", geometry(pointy) is geometry(Layout(layout_pointy, Point(10.0, 15.0), Point(35.0, 71.0))), True)
+	cache = GeometryCache(pointy)
+	h = Hex(3, 4, -7)
+	equal_int("geometry corners", list(cache.polygon_corners(h)), polygon_corners(pointy, h))
+	equal_int("geometry center", cache.hex_to_pixel(h), hex_to_pixel(pointy, h))
+	equal_int("geometry hit", cache.polygons.hits, 0)
+	cache.polygon_corners(h)
+	equal_int("geometry hit", cache.polygons.hits, 1)
+
+def test_hex_ring():
+	ring = hex_ring(Hex(1, -2, 1), 2)
+	equal_int("hex_ring size", 12, len(ring))
+	equal_int("hex_ring distance", True, all(h.distanceTo(Hex(1, -2, 1)) == 2 for h in ring))
+	equal_int("hex_ring unique", 12, len(set(ring)))
+
+def test_hex_spiral():
+	equal_int("hex_spiral size", 37, len(hex_spiral(Hex(0, 0, 0), 3)))
+	equal_int("hex_spiral map", set(generate_hex_map(3)), set(hex_spiral(Hex(0, 0, 0), 3)))
+
 def test_generate_hex_map():
 	equal_int('generate_hex_map', 37, len(generate_hex_map(3).keys()))
 
@@ -243,7 +389,11 @@ def test_all():
 	test_hex_rotate_left()
 	test_hex_round()
 	test_hex_linedraw()
+	test_caches()
 	test_layout()
+	test_hex_unchecked()
+	test_hex_ring()
+	test_hex_spiral()
 	test_generate_hex_map()
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+# batch versions of the hex.py functions, working on NumPy arrays of
+# coordinates. Every function repeats the scalar arithmetic in the same
+# order, so results match hex.py exactly.
+import hex as pl
+import numpy as np
+from typing import Iterable
+
+def coords(hexes:Iterable[pl.Hex]):
+	hexes = list(hexes)
+	q = np.fromiter((h.q for h in hexes), dtype=np.int64, count=len(hexes))
+	r = np.fromiter((h.r for h in hexes), dtype=np.int64, count=len(hexes))
+	return q, r
+
+def hexes(q:np.ndarray, r:np.ndarray):
+	return [pl.Hex.unchecked(a, b, -a - b) for a, b in zip(q.tolist(), r.tolist())]
+
+def distance(aq:np.ndarray, ar:np.ndarray, bq:np.ndarray, br:np.ndarray):
+	dq = aq - bq
+	dr = ar - br
+	return (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+
+def rotate_right(q:np.ndarray, r:np.ndarray, times:int = 1):
+	s = -q - r
+	for i in range(times % 6):
+		q, r, s = -r, -s, -q
+	return q, r
+
+def rotate_left(q:np.ndarray, r:np.ndarray, times:int = 1):
+	s = -q - r
+	for i in range(times % 6):
+		q, r, s = -s, -q, -r
+	return q, r
+
+def hex_round(q:np.ndarray, r:np.ndarray, s:np.ndarray):
+	# FractionalHex.round; np.rint and round() both round halves to even
+	qi = np.rint(q)
+	ri = np.rint(r)
+	si = np.rint(s)
+	q_diff = np.abs(qi - q)
+	r_diff = np.abs(ri - r)
+	s_diff = np.abs(si - s)
+	fix_q = (q_diff > r_diff) & (q_diff > s_diff)
+	fix_r = ~fix_q & (r_diff > s_diff)
+	qi = np.where(fix_q, -ri - si, qi)
+	ri = np.where(fix_r, -qi - si, ri)
+	return qi.astype(np.int64), ri.astype(np.int64)
+
+def lerp(aq:np.ndarray, ar:np.ndarray, a_s:np.ndarray, bq:np.ndarray, br:np.ndarray, bs:np.ndarray, t:np.ndarray):
+	return (aq * (1.0 - t) + bq * t, ar * (1.0 - t) + br * t, a_s * (1.0 - t) + bs * t)
+
+def line(aq:np.ndarray, ar:np.ndarray, bq:np.ndarray, br:np.ndarray):
+	# draw_hex_line for every (a, b) pair. Lines have different lengths, so
+	# they come back concatenated: line i is q[offsets[i]:offsets[i + 1]]
+	aq, ar, bq, br = (np.asarray(x, dtype=np.int64) for x in (aq, ar, bq, br))
+	dist = distance(aq, ar, bq, br)
+	offsets = np.zeros(len(dist) + 1, dtype=np.int64)
+	offsets[1:] = np.cumsum(dist + 1)
+	pair = np.repeat(np.arange(len(dist)), dist + 1)
+	i = np.arange(offsets[-1]) - offsets[pair]
+
+	# drawn from the origin and moved to a, like draw_hex_line, so a line
+	# does not depend on where it is drawn
+	dq = bq - aq
+	dr = br - ar
+	ds = -dq - dr
+	step = 1.0 / np.maximum(dist, 1)
+	t = step[pair] * i
+	zero = np.zeros(len(pair))
+	q, r, s = lerp(zero + 1e-06, zero + 1e-06, zero - 2e-06,
+				dq[pair] + 1e-06, dr[pair] + 1e-06, ds[pair] - 2e-06, t)
+	q, r = hex_round(q, r, s)
+	return offsets, q + aq[pair], r + ar[pair]
+
+def ring_offsets(radius:int):
+	return coords(pl.hex_ring(pl.Hex(0, 0, 0), radius))
+
+def spiral_offsets(radius:int):
+	return coords(pl.hex_spiral(pl.Hex(0, 0, 0), radius))
+
+def ring(q:np.ndarray, r:np.ndarray, radius:int):
+	# hex_ring around every center: (centers, ring size) arrays in hex_ring's order
+	dq, dr = ring_offsets(radius)
+	return np.asarray(q)[:, None] + dq, np.asarray(r)[:, None] + dr
+
+def spiral(q:np.ndarray, r:np.ndarray, radius:int):
+	dq, dr = spiral_offsets(radius)
+	return np.asarray(q)[:, None] + dq, np.asarray(r)[:, None] + dr
+
+def hex_to_pixel(layout:pl.Layout, q:np.ndarray, r:np.ndarray):
+	M = layout.orientation
+	size = layout.size
+	origin = layout.origin
+	x = (M.f0 * q + M.f1 * r) * size.x
+	y = (M.f2 * q + M.f3 * r) * size.y
+	return x + origin.x, y + origin.y
+
+def pixel_to_hex(layout:pl.Layout, x:np.ndarray, y:np.ndarray):
+	M = layout.orientation
+	size = layout.size
+	origin = layout.origin
+	px = (x - origin.x) / size.x
+	py = (y - origin.y) / size.y
+	q = M.b0 * px + M.b1 * py
+	r = M.b2 * px + M.b3 * py
+	return hex_round(q, r, -q - r)
+
+def polygon_corners(layout:pl.Layout, q:np.ndarray, r:np.ndarray):
+	# (hexes, 6, 2) array of corner pixels
+	x, y = hex_to_pixel(layout, q, r)
+	offsets = np.array(pl.geometry(layout).corners)
+	corners = np.empty((len(x), 6, 2))
+	corners[:, :, 0] = x[:, None] + offsets[:, 0]
+	corners[:, :, 1] = y[:, None] + offsets[:, 1]
+	return corners
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def random_hexes(rand:np.random.Generator, count:int, radius:int):
+	q = rand.integers(-radius, radius + 1, count)
+	r = rand.integers(-radius, radius + 1, count)
+	return q, r
+
+def test_distance():
+	rand = np.random.default_rng(0)
+	aq, ar = random_hexes(rand, 500, 50)
+	bq, br = random_hexes(rand, 500, 50)
+	expected = [a.distanceTo(b) for a, b in zip(hexes(aq, ar), hexes(bq, br))]
+	equal_int('batch distance', distance(aq, ar, bq, br).tolist(), expected)
+
+def test_rotate():
+	rand = np.random.default_rng(1)
+	q, r = random_hexes(rand, 100, 20)
+	equal_int('batch rotate right', list(zip(*(x.tolist() for x in rotate_right(q, r, 2)))), [((h >> 2).q, (h >> 2).r) for h in hexes(q, r)])
+	equal_int('batch rotate left', list(zip(*(x.tolist() for x in rotate_left(q, r, 1)))), [((h << 1).q, (h << 1).r) for h in hexes(q, r)])
+
+def test_round():
+	rand = np.random.default_rng(2)
+	q = rand.uniform(-20, 20, 1000)
+	r = rand.uniform(-20, 20, 1000)
+	# exact halves exercise the round-half-to-even rule
+	q[:100] = np.round(q[:100]) + 0.5
+	r[50:150] = np.round(r[50:150]) - 0.5
+	s = -q - r
+	expected = [pl.FractionalHex(a, b, c).round() for a, b, c in zip(q.tolist(), r.tolist(), s.tolist())]
+	bq, br = hex_round(q, r, s)
+	equal_int('batch round', list(zip(bq.tolist(), br.tolist())), [(h.q, h.r) for h in expected])
+
+def test_line():
+	rand = np.random.default_rng(3)
+	aq, ar = random_hexes(rand, 200, 30)
+	bq, br = random_hexes(rand, 200, 30)
+	offsets, q, r = line(aq, ar, bq, br)
+	for i, (a, b) in enumerate(zip(hexes(aq, ar), hexes(bq, br))):
+		expected = [(h.q, h.r) for h in pl.draw_hex_line(a, b)]
+		got = list(zip(q[offsets[i]:offsets[i + 1]].tolist(), r[offsets[i]:offsets[i + 1]].tolist()))
+		equal_int('batch line', got, expected)
+
+def test_ring_spiral():
+	q = np.array([0, 3, -2])
+	r = np.array([0, -1, 5])
+	rq, rr = ring(q, r, 3)
+	sq, sr = spiral(q, r, 2)
+	for i, h in enumerate(hexes(q, r)):
+		equal_int('batch ring', list(zip(rq[i].tolist(), rr[i].tolist())), [(x.q, x.r) for x in pl.hex_ring(h, 3)])
+		equal_int('batch spiral', list(zip(sq[i].tolist(), sr[i].tolist())), [(x.q, x.r) for x in pl.hex_spiral(h, 2)])
+
+def test_layout():
+	rand = np.random.default_rng(4)
+	q, r = random_hexes(rand, 300, 40)
+	for orientation in (pl.layout_pointy, pl.layout_flat):
+		layout = pl.Layout(orientation, pl.Point(10.0, 15.0), pl.Point(35.0, 71.0))
+		x, y = hex_to_pixel(layout, q, r)
+		expected = [pl.hex_to_pixel(layout, h) for h in hexes(q, r)]
+		equal_int('batch hex_to_pixel', list(zip(x.tolist(), y.tolist())), [(p.x, p.y) for p in expected])
+		px = rand.uniform(-500, 500, 300)
+		py = rand.uniform(-500, 500, 300)
+		hq, hr = pixel_to_hex(layout, px, py)
+		expected = [pl.pixel_to_hex(layout, pl.Point(a, b)) for a, b in zip(px.tolist(), py.tolist())]
+		equal_int('batch pixel_to_hex', list(zip(hq.tolist(), hr.tolist())), [(h.q, h.r) for h in expected])
+		corners = polygon_corners(layout, q[:20], r[:20])
+		expected = [pl.polygon_corners(layout, h) for h in hexes(q[:20], r[:20])]
+		equal_int('batch corners', corners.tolist(), [[[c.x, c.y] for c in cs] for cs in expected])
+
+def test_all():
+	test_distance()
+	test_rotate()
+	test_round()
+	test_line()
+	test_ring_spiral()
+	test_layout()
+
+if __name__ == '__main__':
+	test_all()
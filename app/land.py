@@ -1,21 +1,180 @@
 import terrain as te
+import field as fd
+import events as ev
+import path as pa
 import living as lv
 import hex as pl
-import collections
-from typing import Dict
+import rng as rn
+import entities as es
+import storage as st
+import perception as pc
+import bisect
+import collections.abc
+import numpy as np
+from typing import Any, Dict
+
+class HexagonIndex:
+	# closed-form cell ids for the hexagon of generate_hex_map: cells are
+	# numbered in the same order, column by column of q, then by r
+	def __init__(self, radius:int):
+		self.radius = radius
+		qs = np.arange(-radius, radius + 1)
+		self.r_min = np.maximum(-radius, -qs - radius)
+		self.r_max = np.minimum(radius, -qs + radius)
+		self.row_start = np.zeros(2 * radius + 2, dtype=np.int64)
+		self.row_start[1:] = np.cumsum(self.r_max - self.r_min + 1)
+		self.size = int(self.row_start[-1])
+		self.r_min_list = self.r_min.tolist()
+		self.row_start_list = self.row_start.tolist()
+
+	def __repr__(self):
+		return 'HexagonIndex(radius:{}, cells:{})'.format(self.radius, self.size)
+
+	def __len__(self):
+		return self.size
+
+	def cell_id(self, q:int, r:int):
+		# None when (q, r) lies outside
+		radius = self.radius
+		if -radius <= q <= radius and -radius <= r <= radius and -radius <= -q - r <= radius:
+			return self.row_start_list[q + radius] + r - self.r_min_list[q + radius]
+		return None
+
+	def cell_ids(self, q:np.ndarray, r:np.ndarray):
+		# like cell_id for arrays, with len(self) for coordinates outside
+		radius = self.radius
+		inside = (np.abs(q) <= radius) & (np.abs(r) <= radius) & (np.abs(q + r) <= radius)
+		column = np.clip(q + radius, 0, 2 * radius)
+		ids = self.row_start[column] + r - self.r_min[column]
+		return np.where(inside, ids, self.size)
+
+	def coord(self, cell:int):
+		column = bisect.bisect_right(self.row_start_list, cell) - 1
+		return column - self.radius, cell - self.row_start_list[column] + self.r_min_list[column]
+
+	def coords(self, cells:np.ndarray):
+		column = np.searchsorted(self.row_start, cells, side='right') - 1
+		return column - self.radius, cells - self.row_start[column] + self.r_min[column]
+
+	def neighbors_of(self, cells:np.ndarray):
+		# (cells, directions) neighbor ids, len(self) where there is none
+		q, r = self.coords(np.asarray(cells, dtype=np.int64))
+		dq = np.array([d.q for d in pl.Directions])
+		dr = np.array([d.r for d in pl.Directions])
+		return self.cell_ids(q[:, None] + dq, r[:, None] + dr).astype(np.intp)
+
+	def neighbors(self, cell:int):
+		# neighbors_of for a single cell, as a list of ints
+		q, r = self.coord(cell)
+		size = len(self)
+		ids = [self.cell_id(q + d.q, r + d.r) for d in pl.Directions]
+		return [size if n is None else n for n in ids]
+
+class TerrainMap(collections.abc.Mapping):
+	# Land.map: Hex (or (q, r)) -> Terrain, creating each Terrain on first touch
+	def __init__(self, land:'Land'):
+		self.land = land
+		self.index = land.index
+		self.created = {} #Dict[int, Terrain]
+
+	def __repr__(self):
+		return 'TerrainMap(cells:{}, created:{})'.format(len(self.index), len(self.created))
+
+	def cell_of(self, p:'Any'):
+		if isinstance(p, pl.Hex):
+			return self.index.cell_id(p.q, p.r)
+		return self.index.cell_id(p[0], p[1])
+
+	def terrain(self, cell:int):
+		t = self.created.get(cell)
+		if t is None:
+			q, r = self.index.coord(cell)
+			t = te.Terrain(pl.Hex.unchecked(q, r, -q - r))
+			t.cell = cell
+			t.land = self.land
+			t.field = self.land.field
+			t.passable = bool(self.land.passable[cell])
+			self.created[cell] = t
+		return t
+
+	def __getitem__(self, p:'Any'):
+		cell = self.cell_of(p)
+		if cell is None:
+			raise KeyError(p)
+		return self.terrain(cell)
+
+	def __contains__(self, p:'Any'):
+		return self.cell_of(p) is not None
+
+	def __iter__(self):
+		for cell in range(len(self.index)):
+			yield self.terrain(cell).polygon
+
+	def __len__(self):
+		return len(self.index)
+
+class CellSequence(collections.abc.Sequence):
+	# Land.terrains and Land.cells: indexed by cell id, created on access
+	def __init__(self, terrains:TerrainMap, attribute:str = None):
+		self.terrains = terrains
+		self.attribute = attribute
+
+	def __getitem__(self, cell:'Any'):
+		if isinstance(cell, slice):
+			return [self[i] for i in range(*cell.indices(len(self)))]
+		if cell < 0:
+			cell += len(self)
+		if not 0 <= cell < len(self):
+			raise IndexError(cell)
+		t = self.terrains.terrain(cell)
+		return getattr(t, self.attribute) if self.attribute else t
+
+	def __len__(self):
+		return len(self.terrains)
 
 class Land:
-	def __init__(self, radius:int, screen_size:int, terrain_size:int):
+	def __init__(self, radius:int, screen_size:int, terrain_size:int, seed:int = 0, storage:'st.Mapped' = None):
 		self.terrain_size = terrain_size
+		self.screen_size = screen_size
 		self.radius = radius
+		self.tick = 0
+		self.events = ev.EventLog()
+		self.seed = seed
+		self.random = rn.Stream(seed) # every random draw in this world
 		self.layout = pl.Layout(pl.layout_pointy,
 								pl.Point(terrain_size, terrain_size),
 								pl.Point(screen_size // 2, screen_size // 2))
+		self.geometry = pl.geometry(self.layout)
+
+		# replace the index to switch from a hexagon to other shapes. Terrains and
+		# their neighbor links are only created when first touched, so a huge
+		# world costs nothing until something happens in it
+		self.index = HexagonIndex(radius)
+		self.map = TerrainMap(self)
 
-		# replace this map to switch from hexes to i.e. squares
-		self.map = {p:te.Terrain(p) for p in pl.generate_hex_map(radius)}
-		for k, v in self.map.items():
-			v.neighbors = self.neighborhood(k, v)
+		# interned coordinates and terrains, both indexed by cell id
+		self.cells = CellSequence(self.map, 'polygon')
+		self.terrains = CellSequence(self.map)
+		self._neighbor_table = None
+
+		# bumped on every terrain change, so cached paths know they are stale
+		self.version = 0
+		# per-cell arrays, in memory or memory-mapped files for lands larger than RAM
+		self.storage = storage if storage is not None else st.InMemory()
+		self.passable = self.storage.array('passable', (len(self.index),), bool, fill=True)
+
+		self.attach_field(fd.SmellField(self))
+
+		# hp, state and stats of every Living placed here, one row each
+		self.entities = es.EntityStore()
+
+		# livings by the cell they stand on, kept up to date as they move
+		self.occupants = {} #Dict[int, Set[Living]]
+
+		self.paths = pa.Pathfinder(self)
+
+		# what each living senses around it, refreshed once per tick for all of them
+		self.perception = pc.Perception(self)
 
 	def __repr__(self):
 		return 'Land(radius:{}, unit_size:{})'.format(self.radius, self.terrain_size)
@@ -23,19 +182,96 @@ class Land:
 	def __str__(self):
 		return repr(self)
 		
-	def neighborhood(self, p:'Polygon', t:'te.Terrain'):
+	def attach_field(self, field:'fd.SmellField'):
+		replaced = getattr(self, 'field', None)
+		self.field = field
+		for v in self.map.created.values():
+			v.field = field
+		if replaced is not None and replaced is not field:
+			replaced.release()
+
+	@property
+	def neighbor_table(self):
+		# neighbor cell ids of every cell by direction, len(cells) where there is none.
+		# Built on first use; hot paths ask neighbors_of for just the cells they need
+		if self._neighbor_table is None:
+			self._neighbor_table = self.neighbors_of(np.arange(len(self.index)))
+		return self._neighbor_table
+
+	def neighbors_of(self, cells:np.ndarray):
+		return self.index.neighbors_of(cells)
+
+	def neighbors(self, cell:int):
+		# neighbor ids of one cell by direction, from the table once it is built
+		if self._neighbor_table is not None:
+			return self._neighbor_table[cell].tolist()
+		return self.index.neighbors(cell)
+
+	def neighborhood(self, t:'te.Terrain'):
 		neighborhood = {}
-		for direction in range(len(pl.Directions)):
-			n_coords = p.neighbor(direction)
-			if (n_coords in self.map):
-				neighborhood[pl.Directions[direction]] = self.map[n_coords]
+		p = t.polygon
+		for direction, d in enumerate(pl.Directions):
+			cell = self.index.cell_id(p.q + d.q, p.r + d.r)
+			if cell is not None:
+				neighborhood[d] = self.map.terrain(cell)
 		return neighborhood
 
+	def set_passable(self, t:'te.Terrain', passable:bool):
+		if t.passable != passable:
+			t.passable = passable
+			self.passable[t.cell] = passable
+			self.version += 1
+
+	def relocate(self, l:'lv.Living', old:'te.Terrain', new:'te.Terrain'):
+		if old is not None and old.land is self:
+			self.remove(l, old)
+		if new is not None:
+			self.occupants.setdefault(new.cell, set()).add(l)
+
+	def remove(self, l:'lv.Living', t:'te.Terrain'):
+		cell = self.occupants.get(t.cell)
+		if cell is not None:
+			cell.discard(l)
+			if not cell:
+				del self.occupants[t.cell]
+
+	def occupants_at(self, t:'te.Terrain'):
+		return self.occupants.get(t.cell, set())
+
+	def in_range(self, t:'te.Terrain', radius:int):
+		# livings at most 'radius' hexes away, walking whichever is smaller:
+		# the hexes in range or the occupied cells
+		area = 3 * radius * (radius + 1) + 1
+		if area <= len(self.occupants):
+			# through the index, so no Terrain is created for the hexes walked
+			found = []
+			for p in pl.hex_spiral(t.polygon, radius):
+				cell = self.index.cell_id(p.q, p.r)
+				if cell is not None:
+					found.extend(self.occupants.get(cell, ()))
+			return found
+
+		center = t.polygon
+		return [l for cell, ls in self.occupants.items() if center.distanceTo(self.cells[cell]) <= radius for l in ls]
+
+	def nearest(self, t:'te.Terrain', max_radius:int = None, predicate:'Callable[[lv.Living], bool]' = None):
+		# closest living for which predicate holds, searching ring by ring
+		max_radius = 2 * self.radius if max_radius is None else max_radius
+		for k in range(max_radius + 1):
+			for p in pl.hex_ring(t.polygon, k):
+				cell = self.index.cell_id(p.q, p.r)
+				if cell is None:
+					continue
+				for l in self.occupants.get(cell, ()):
+					if predicate is None or predicate(l):
+						return l
+		return None
+
 	def polygon_corners(self, t:'te.Terrain'):
-		return pl.polygon_corners(self.layout, t.polygon)
+		return self.geometry.polygon_corners(t.polygon)
 
 	def polygon_center(self, t:'te.Terrain'):
-		return pl.hex_to_pixel(self.layout, t.polygon)
+		return self.geometry.hex_to_pixel(t.polygon)
 
 	def pixel_to_terrain(self, p:pl.Point):
 		polygon = pl.pixel_to_hex(self.layout, p)
@@ -52,8 +288,54 @@ def equal_int(name:str, a:int, b:int):
 	if not (a == b):
 		complain(name)
 
+def test_index():
+	land = Land(4, 800, 20)
+	equal_int('index order', list(land.map), list(pl.generate_hex_map(4)))
+	equal_int('index lazy', len(land.map.created), 61)
+	equal_int('index outside', (5, 0) in land.map, False)
+	equal_int('index tuple', land.map[(1, -2)].polygon, pl.Hex(1, -2, 1))
+	equal_int('index negative', land.terrains[-1].cell, len(land.cells) - 1)
+
+	huge = Land(2000, 800, 20)
+	t = huge.map[(0, 0)]
+	equal_int('lazy neighbors', len(t.neighbors), 6)
+	equal_int('lazy created', len(huge.map.created), 7)
+
+def test_neighbor_table():
+	land = Land(3, 800, 20)
+	for t in land.map.values():
+		expected = {pl.Directions[d]:t.polygon.neighbor(d) for d in range(6) if t.polygon.neighbor(d) in land.map}
+		equal_int('neighborhood size', len(t.neighbors), len(expected))
+		for d, n in t.neighbors.items():
+			equal_int('neighborhood', n.polygon == expected[d], True)
+			equal_int('neighbor interned', n.polygon is land.cells[n.cell], True)
+	equal_int('neighbors scalar', [land.index.neighbors(c) for c in range(len(land.cells))], land.neighbors_of(np.arange(len(land.cells))).tolist())
+
+def test_occupancy():
+	land = Land(4, 800, 20)
+	a = lv.Living(0, 'A', land.map[(0, 0)])
+	b = lv.Living(1, 'B', land.map[(2, 0)])
+	c = lv.Living(2, 'C', land.map[(-4, 0)])
+	equal_int('occupants at', land.occupants_at(land.map[(0, 0)]), {a})
+	equal_int('in range', set(land.in_range(land.map[(0, 0)], 2)), {a, b})
+	equal_int('in range large', set(land.in_range(land.map[(0, 0)], 4)), {a, b, c})
+	equal_int('nearest', land.nearest(land.map[(0, 0)], predicate=lambda l: l != a), b)
+	equal_int('nearest bounded', land.nearest(land.map[(-1, 0)], max_radius=2, predicate=lambda l: l != a), None)
+
+	created = len(land.map.created)
+	land.nearest(land.map[(0, 0)], predicate=lambda l: False)
+	land.in_range(land.map[(2, 0)], 0) # walks the spiral: fewer hexes than occupied cells
+	equal_int('queries stay lazy', len(land.map.created), created)
+
+	b.path = [land.map[(3, 0)]]
+	b.follow_path()
+	equal_int('moved from', land.occupants_at(land.map[(2, 0)]), set())
+	equal_int('moved to', land.occupants_at(land.map[(3, 0)]), {b})
+
 def test_all():
-	pass
+	test_index()
+	test_neighbor_table()
+	test_occupancy()
 
 if __name__ == '__main__':
 	test_all()
\ No newline at end of file
@@ -1,5 +1,8 @@
-import random
 import land as ld
+import events as ev
+import field as fd
+import rng as rn
+import entities as es
 from enum import Enum
 from typing import NamedTuple
 
@@ -10,10 +13,19 @@ class LivingState(Enum): # TODO: implement as class with getter and setters
 	FIGHTING = 4
 	DEAD = 5
 
+States = {s.value:s for s in LivingState}
+
 class Living:
+	# numbers and state live in the Land's EntityStore, one row per Living;
+	# the object keeps what does not fit in an array
+	__slots__ = ('uid', 'name', 'store', 'row', '_position', 'last_direction', 'path', 'hunt_smell', 'smell_decay_strength', 'targets')
+
 	def __init__(self, uid:int, name:str, position:'ld.Terrain'):
 		self.uid = uid #str
 		self.name = name #str
+		self.store = position.land.entities if position.land is not None else es.unplaced
+		self.row = self.store.add(self)
+		self._position = None
 		self.position = position #Terrain
 		self.last_direction = None #ld.Directions
 		self.path = [] #List[Terrain]
@@ -28,7 +40,6 @@ class Living:
 		self.current_hp = self.max_hp
 		self.attack_strength = 5
 		self.defense_strength = 0
-		self.incoming_damage = {} #Dict[Living(Source), int]
 
 	def __repr__(self):
 		return 'Living(uid:{}, name:{}, position:{}, state:{})'.format(self.uid, self.name, self.position, self.state)
@@ -42,11 +53,109 @@ class Living:
 	def __eq__(self, other:'Living'):
 		return self.uid == other.uid
 
+	@property
+	def position(self):
+		return self._position
+
+	@position.setter
+	def position(self, position:'te.Terrain'):
+		# keeps the Land's occupancy index in step with every move
+		old = self._position
+		self._position = position
+		land = position.land
+		if land is not None:
+			self.store.cell[self.row] = position.cell
+			land.relocate(self, old, position)
+
+	@property
+	def state(self):
+		return States[int(self.store.state[self.row])]
+
+	@state.setter
+	def state(self, state:LivingState):
+		self.store.state[self.row] = state.value
+
+	@property
+	def seen_state(self):
+		# the state other livings go by: as it was when the last phase ended
+		return States.get(int(self.store.seen_state[self.row]), self.state)
+
+	@property
+	def current_hp(self):
+		return int(self.store.hp[self.row])
+
+	@current_hp.setter
+	def current_hp(self, hp:int):
+		self.store.hp[self.row] = hp
+
+	@property
+	def max_hp(self):
+		return int(self.store.max_hp[self.row])
+
+	@max_hp.setter
+	def max_hp(self, hp:int):
+		self.store.max_hp[self.row] = hp
+
+	@property
+	def hp_regen(self):
+		return int(self.store.regen[self.row])
+
+	@hp_regen.setter
+	def hp_regen(self, regen:int):
+		self.store.regen[self.row] = regen
+
+	@property
+	def attack_strength(self):
+		return int(self.store.attack[self.row])
+
+	@attack_strength.setter
+	def attack_strength(self, strength:int):
+		self.store.attack[self.row] = strength
+
+	@property
+	def defense_strength(self):
+		return int(self.store.defense[self.row])
+
+	@defense_strength.setter
+	def defense_strength(self, strength:int):
+		self.store.defense[self.row] = strength
+
+	@property
+	def incoming_damage(self):
+		# Dict[Living(Source), int]
+		return self.store.damage_to(self.row)
+
+	@incoming_damage.setter
+	def incoming_damage(self, damage:'Dict[Living, int]'):
+		self.store.set_damage_to(self.row, damage)
+
+	@property
+	def events(self):
+		land = self.position.land
+		return land.events if land is not None else ev.null_log
+
+	@property
+	def random(self):
+		land = self.position.land
+		return land.random if land is not None else rn.unplaced
+
 	def generateSmell(self):
 		return Smell(self, 100)
 
 	def attack(self, source:'Living', damage:int):
-		self.incoming_damage[source] = damage
+		self.store.strike(self.row, source.row, damage)
+
+	def is_adjacent(self, other:'Living'):
+		return self.position.polygon.distanceTo(other.position.polygon) == 1
+
+	def path_to(self, target:'te.Terrain'):
+		# shortest path on the land, cached until its terrain changes
+		self.path = self.position.land.paths.astar(self.position, target)
+
+	def path_towards(self, targets:'Iterable[te.Terrain]', steps:int = None, reach:int = None):
+		# walks down a distance field shared by everyone heading for the same targets
+		paths = self.position.land.paths
+		self.path = paths.descend(paths.distance_field(targets, reach), self.position, steps)
 
 	def follow_path(self):
 		last_position = self.position
@@ -77,30 +186,32 @@ class Living:
 
 		elif l_state == LivingState.DEAD:
 			self.state = LivingState.DEAD
+			if self.position.land is not None:
+				self.position.land.remove(self, self.position)
 
 	def update_state(self): # search for whatever it is that drives me. Implement simple any smell search first
 		
 		if self.current_hp <= 0:
 			self.set_state(LivingState.DEAD)
-			print(f'{self} died!')
+			self.events.info(self.uid, 'died')
 
 		elif self.state == LivingState.SEARCHING:
 			interesting_smells = list(x for x in self.position.smells.values() if x.source != self)
 			if len(interesting_smells) > 0:
 				strongest_smell = max(interesting_smells, key=lambda x: x.strength)
 				self.set_state(LivingState.HUNTING, strongest_smell)
-				print('{} caught a scent: {}'.format(self, self.hunt_smell))
+				self.events.info(self.uid, 'scent', source=strongest_smell.source.uid, strength=strongest_smell.strength)
 
 		elif self.state == LivingState.HUNTING:
 			prey = self.hunt_smell.source
 
-			if prey.position in self.position.neighbors.values():
+			if self.is_adjacent(prey):
 				self.set_state(LivingState.FIGHTING, target = prey)
-				print(f'{self} engaged its prey!')
+				self.events.info(self.uid, 'engaged', target=prey.uid)
 
 			elif prey not in self.position.smells:
 				self.set_state(LivingState.SEARCHING)
-				print('{} lost its prey!'.format(self))
+				self.events.info(self.uid, 'lost_prey', target=prey.uid)
 				
 			elif self.position.smells[prey].strength > self.hunt_smell.strength:
 				self.hunt_smell = self.position.smells[prey]
@@ -108,51 +219,66 @@ class Living:
 		elif self.state == LivingState.FIGHTING:
 			prey = self.targets[0] if len(self.targets) > 0 else None
 
-			if prey is None or prey.state == LivingState.DEAD:
+			if prey is None or prey.seen_state == LivingState.DEAD:
 				self.set_state(LivingState.SEARCHING)
-				print(f'{self} killed its prey!')
+				self.events.info(self.uid, 'killed', target=prey.uid if prey is not None else None)
 
 			else:
-				if prey.position in self.position.neighbors.values():
+				if self.is_adjacent(prey):
 					prey.attack(self, self.attack_strength)
 
 				else:
 					self.set_state(LivingState.HUNTING, self.position.smells[prey])
 
 
+	def heard(self, channel:'fd.Channel'):
+		# (cell, strength) of the strongest signal within perception range, or None
+		land = self.position.land
+		if land is None or land.perception.tick != land.tick:
+			return None
+		return land.perception.loudest_cell(self, channel)
+
 	def update_path(self):
 		if self.state == LivingState.RESTING:
 			self.path = []
 		elif self.state == LivingState.SEARCHING:
-			self.path = [random.choice(list(self.position.neighbors.values()))]
+			pos_neighbors = self.position.open_neighbors()
+			heard = self.heard(fd.Sound)
+			if heard is not None and pos_neighbors:
+				# towards the loudest fight within earshot
+				target = self.position.land.cells[heard[0]]
+				self.path = [min(pos_neighbors, key=lambda x: x.polygon.distanceTo(target))]
+			else:
+				self.path = [self.random.choice(pos_neighbors)] if pos_neighbors else []
 		elif self.state == LivingState.HUNTING:
 			prey = self.hunt_smell.source
-			pos_neighbors = self.position.neighbors.values()
+			pos_neighbors = self.position.open_neighbors()
+			if not pos_neighbors:
+				self.path = []
+				return
 			step_candidates = list(x for x in pos_neighbors if prey in x.smells and x.smells[prey].strength >= self.hunt_smell.strength)
 			if len(step_candidates) > 0:
 				next_step = max(step_candidates, key=lambda x: x.smells[prey].strength)
-				print('current: {} ({})'.format(self.position, self.position.smells[prey].strength))
-				print('candidates:')
-				for candidate in step_candidates:
-					print('{} (strength: {})'.format(candidate, candidate.smells[prey].strength))
-				print('next_step: {}'.format(next_step))
+				if self.events.enabled(ev.Level.DEBUG):
+					self.events.debug(self.uid, 'step', target=prey.uid,
+									current=(self.position.polygon.q, self.position.polygon.r),
+									candidates=[(c.polygon.q, c.polygon.r, c.smells[prey].strength) for c in step_candidates],
+									next=(next_step.polygon.q, next_step.polygon.r))
 			else:
-				next_step = random.choice(list(pos_neighbors))
-				print('{} struggles to find {}!'.format(self, prey))
+				next_step = self.random.choice(pos_neighbors)
+				if self.events.enabled(ev.Level.DEBUG):
+					self.events.debug(self.uid, 'struggles', target=prey.uid)
 			self.path = [next_step]
 
 	def update_hp(self):
-		self.current_hp = min(self.max_hp, self.current_hp + self.hp_regen)
-
-		for dmg in self.incoming_damage.values():
-			actual_dmg = max(0, dmg - self.defense_strength)
-			self.current_hp = max(0, self.current_hp - actual_dmg)
-
-		self.incoming_damage = {}
+		# the engine does this for every living at once, see EntityStore.update_hp
+		self.store.update_hp([self.row])
 
 	def move(self):
 		self.follow_path()
 		self.position.smells[self] = self.generateSmell()
+		if self.state == LivingState.FIGHTING and self.position.field is not None:
+			self.position.field.emit(self.position.cell, self, 100, fd.Sound)
 
 	def act(self):
 		self.update_hp()
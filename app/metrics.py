@@ -0,0 +1,153 @@
+# per-tick world statistics, streamed to disk in fixed-size chunks so a
+# run of any length only ever holds one chunk in memory
+import living as lv
+import csv
+import os
+import numpy as np
+from typing import Iterable, List
+
+HpBins = 4 # hp histogram buckets, as fractions of max hp
+
+Columns = (['tick']
+		+ ['population_{}'.format(s.name.lower()) for s in lv.LivingState]
+		+ ['smell_mass', 'active_cells', 'kills', 'hp_mean', 'hp_min', 'hp_max']
+		+ ['hp_bin_{}'.format(i) for i in range(HpBins)])
+
+# csv format of every column: all counts are written whole, hp_mean in full
+Formats = ['%.17g' if c == 'hp_mean' else '%d' for c in Columns]
+
+def tick_stats(land:'ld.Land', livings:Iterable[lv.Living], deaths:int):
+	states = {s:0 for s in lv.LivingState}
+	hp = []
+	hp_fraction = []
+	for l in livings:
+		states[l.state] += 1
+		if l.state != lv.LivingState.DEAD:
+			hp.append(l.current_hp)
+			hp_fraction.append(l.current_hp / l.max_hp if l.max_hp > 0 else 0.0)
+
+	field = land.field
+	occupied = field.occupied() # scent emitted while moving is not in field.active yet
+	smell_mass = int(field.strength[occupied, :len(field.sources)].sum())
+	bins = np.histogram(np.clip(hp_fraction, 0.0, 1.0), bins=HpBins, range=(0.0, 1.0))[0] if hp else np.zeros(HpBins)
+	return ([land.tick]
+		+ [states[s] for s in lv.LivingState]
+		+ [smell_mass, len(occupied), deaths,
+			float(np.mean(hp)) if hp else 0.0, min(hp, default=0), max(hp, default=0)]
+		+ bins.tolist())
+
+class MetricsRecorder:
+	# tick observer writing one row per tick, either appended to a CSV file
+	# or as numbered .npy chunk files next to 'path'
+	def __init__(self, path:str, format:str = 'csv', chunk:int = 1024, dead:int = 0):
+		# 'dead' are the livings already dead when recording starts, e.g. in a
+		# resumed checkpoint, so the first tick counts only its own kills
+		assert format in ('csv', 'npy'), 'unknown metrics format {}'.format(format)
+		self.path = path
+		self.format = format
+		self.rows = np.zeros((chunk, len(Columns)))
+		self.count = 0
+		self.chunks = 0
+		self.dead = dead
+		if format == 'csv':
+			self.f = open(path, 'w', newline='')
+			csv.writer(self.f).writerow(Columns)
+
+	def __repr__(self):
+		return 'MetricsRecorder(path:{}, format:{}, rows:{})'.format(self.path, self.format, self.chunks * len(self.rows) + self.count)
+
+	def on_tick(self, land:'ld.Land', livings:Iterable[lv.Living]):
+		dead = sum(1 for l in livings if l.state == lv.LivingState.DEAD)
+		deaths = dead - self.dead
+		self.dead = dead
+		self.rows[self.count] = tick_stats(land, livings, deaths)
+		self.count += 1
+		if self.count == len(self.rows):
+			self.flush()
+
+	def chunk_path(self, i:int):
+		root, ext = os.path.splitext(self.path)
+		return '{}_{:05d}.npy'.format(root, i)
+
+	def flush(self):
+		rows = self.rows[:self.count]
+		if self.format == 'csv':
+			np.savetxt(self.f, rows, delimiter=',', fmt=Formats)
+			self.f.flush()
+		elif self.count:
+			np.save(self.chunk_path(self.chunks), rows)
+		self.chunks += 1 if self.count else 0
+		self.count = 0
+
+	def close(self):
+		self.flush()
+		if self.format == 'csv':
+			self.f.close()
+
+def load_chunks(path:str):
+	# joins the .npy chunks written for 'path' back into one array
+	root, ext = os.path.splitext(path)
+	chunks = []
+	i = 0
+	while os.path.exists('{}_{:05d}.npy'.format(root, i)):
+		chunks.append(np.load('{}_{:05d}.npy'.format(root, i)))
+		i += 1
+	return np.concatenate(chunks) if chunks else np.zeros((0, len(Columns)))
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_recorder():
+	import engine as en
+	import land as ld
+	import tempfile
+	with tempfile.TemporaryDirectory() as tmp:
+		land = ld.Land(4, 800, 20)
+		livings = en.populate(land, 6)
+		csv_path = os.path.join(tmp, 'metrics.csv')
+		npy_path = os.path.join(tmp, 'metrics.npy')
+		recorders = [MetricsRecorder(csv_path, chunk=4), MetricsRecorder(npy_path, format='npy', chunk=4)]
+		en.run(land, livings, 10, observers=recorders)
+		for recorder in recorders:
+			recorder.close()
+
+		rows = np.loadtxt(csv_path, delimiter=',', skiprows=1)
+		chunks = load_chunks(npy_path)
+		equal_int('csv rows', rows.shape, (10, len(Columns)))
+		equal_int('npy rows', chunks.shape, (10, len(Columns)))
+		equal_int('npy chunks', recorders[1].chunks, 3)
+		equal_int('csv ticks', rows[:, 0].tolist(), list(range(1, 11)))
+		population = rows[:, 1:1 + len(lv.LivingState)].sum(axis=1)
+		equal_int('population', population.tolist(), [6.0] * 10)
+		dead = Columns.index('population_dead')
+		equal_int('kills', rows[:, Columns.index('kills')].sum(), rows[-1, dead])
+		equal_int('smell mass', bool((rows[:, Columns.index('smell_mass')] > 0).all()), True)
+
+		# resumed with some livings dead already: only new deaths are kills
+		before = sum(1 for l in livings if l.state == lv.LivingState.DEAD)
+		recorder = MetricsRecorder(os.path.join(tmp, 'resumed.csv'), dead=before)
+		en.run(land, livings, 5, observers=[recorder])
+		recorder.close()
+		rows = np.loadtxt(os.path.join(tmp, 'resumed.csv'), delimiter=',', skiprows=1)
+		equal_int('resumed kills', rows[:, Columns.index('kills')].sum(), rows[-1, dead] - before)
+
+		# large counts are written exactly, not rounded to six digits
+		recorder = MetricsRecorder(os.path.join(tmp, 'large.csv'))
+		recorder.rows[0] = np.arange(len(Columns)) + 123456789
+		recorder.count = 1
+		recorder.close()
+		rows = np.loadtxt(os.path.join(tmp, 'large.csv'), delimiter=',', skiprows=1)
+		equal_int('exact counts', rows.tolist(), (np.arange(len(Columns)) + 123456789).tolist())
+
+def test_all():
+	test_recorder()
+
+if __name__ == '__main__':
+	test_all()
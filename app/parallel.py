@@ -0,0 +1,255 @@
+# SmellField that advances each sector of the map in its own worker process.
+# Strengths live in shared memory, so a worker reads its border neighbors'
+# emissions straight from the other sectors' rows instead of exchanging copies.
+# Each worker gets only the active or frontier cells of its sector. Livings
+# still move and act in the main process.
+import field as fd
+import hex as pl
+import hexarray as ha
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List
+
+def sectors(land:'ld.Land', count:int):
+	# splits the hex disc into 'count' contiguous angular sectors of similar size
+	q, r = land.index.coords(np.arange(len(land.index)))
+	x, y = ha.hex_to_pixel(pl.Layout(pl.layout_pointy, pl.Point(1.0, 1.0), pl.Point(0.0, 0.0)), q, r)
+	angles = np.arctan2(y, x)
+	order = np.argsort(angles, kind='stable')
+	return [np.sort(region) for region in np.array_split(order, count)]
+
+class SharedArray:
+	def __init__(self, shape:tuple, dtype:type = np.int32):
+		size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+		self.shm = shared_memory.SharedMemory(create=True, size=size)
+		self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+		self.array[...] = 0
+
+	@property
+	def name(self):
+		return self.shm.name
+
+	def release(self):
+		self.array = None
+		self.shm.close()
+		self.shm.unlink()
+
+class ParallelSmellField(fd.SmellField):
+	def __init__(self, land:'ld.Land', workers:int, capacity:int = 8):
+		self.buffers = []
+		super().__init__(land, capacity)
+		self.regions = sectors(land, workers)
+		self.region_of = np.zeros(self.size, dtype=np.intp) #sector of every cell
+		for i, region in enumerate(self.regions):
+			self.region_of[region] = i
+		self.pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(land.neighbor_table,))
+
+	def __repr__(self):
+		return 'ParallelSmellField(cells:{}, sources:{}, workers:{})'.format(self.size, len(self.sources), len(self.regions))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	@property
+	def strength(self):
+		return self.buffers[0].array
+
+	@strength.setter
+	def strength(self, strength:np.ndarray):
+		# any reallocation (initial or grow) moves the strengths into shared
+		# memory, and the storage array they came in is given back at once:
+		# with memory-mapped storage the field still lives in shared memory
+		front = SharedArray(strength.shape)
+		front.array[...] = strength
+		back = SharedArray(strength.shape)
+		for buffer in self.buffers:
+			buffer.release()
+		self.buffers = [front, back]
+		self.written = np.zeros(0, dtype=np.intp)
+		self.storage.release(strength)
+
+	def split(self, rows:np.ndarray):
+		# 'rows' by sector, each part still sorted; empty sectors are left out
+		regions = self.region_of[rows]
+		order = np.argsort(regions, kind='stable')
+		bounds = np.searchsorted(regions[order], np.arange(1, len(self.regions)))
+		return [part for part in np.split(rows[order], bounds) if len(part)]
+
+	def map_regions(self, task:'Callable', rows:np.ndarray, *args:'Any'):
+		# runs 'task' in the workers over the part of 'rows' in each sector, so
+		# only cells that hold or can receive a signal are ever sent
+		names = [b.name for b in self.buffers]
+		shape = self.buffers[0].array.shape
+		futures = [self.pool.submit(task, part, names, shape, *args) for part in self.split(rows)]
+		return [f.result() for f in futures]
+
+	def decay(self):
+		if self.touched:
+			touched = np.fromiter(self.touched, dtype=np.intp, count=len(self.touched))
+			self.active = np.union1d(self.active, touched)
+			self.touched.clear()
+		self.map_regions(decay_region, self.active, self.decay_rates, len(self.sources))
+
+	def diffuse(self):
+		# the rows the write buffer still holds from its last diffusion are
+		# cleared here; the workers write just the frontier
+		n = len(self.sources)
+		frontier = self.frontier
+		back = self.buffers[1].array
+		self.in_frontier[frontier] = True
+		back[self.written[~self.in_frontier[self.written]], :n] = 0
+		self.in_frontier[frontier] = False
+		self.written = frontier
+		active = self.map_regions(diffuse_region, frontier, self.attenuation, n)
+		self.active = np.concatenate(active) if active else np.zeros(0, dtype=np.intp)
+
+	def swap(self):
+		self.buffers.reverse()
+
+	def release(self):
+		self.close()
+
+	def close(self):
+		self.pool.shutdown()
+		for buffer in self.buffers:
+			buffer.release()
+		self.buffers = []
+
+
+# worker side
+
+worker = {}
+
+def init_worker(neighbors:np.ndarray):
+	worker['neighbors'] = neighbors
+	worker['shared'] = {}
+
+def attach(names:List[str], shape:tuple):
+	shared = worker['shared']
+	for name in list(shared):
+		if name not in names:
+			shared.pop(name)[0].close()
+	arrays = []
+	for name in names:
+		if name not in shared:
+			shm = shared_memory.SharedMemory(name=name)
+			shared[name] = (shm, np.ndarray(shape, dtype=np.int32, buffer=shm.buf))
+		arrays.append(shared[name][1])
+	return arrays
+
+def decay_region(rows:np.ndarray, names:List[str], shape:tuple, decay_rates:np.ndarray, n:int):
+	front, back = attach(names, shape)
+	front[rows, :n] = np.maximum(front[rows, :n] - decay_rates[:n], 0)
+
+def diffuse_region(rows:np.ndarray, names:List[str], shape:tuple, attenuation:np.ndarray, n:int):
+	front, back = attach(names, shape)
+	neighbors = worker['neighbors'][rows]
+	updated = front[rows, :n]
+	fd.attenuate(updated, front, neighbors, attenuation[:n])
+	back[rows, :n] = updated
+	return rows[updated.any(axis=1)]
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_sectors():
+	import land as ld
+	land = ld.Land(4, 800, 20)
+	regions = sectors(land, 3)
+	equal_int('sectors count', len(regions), 3)
+	equal_int('sectors cover', sorted(np.concatenate(regions).tolist()), list(range(len(land.cells))))
+
+def test_split():
+	import land as ld
+	land = ld.Land(5, 800, 20)
+	with ParallelSmellField(land, 3) as field:
+		rows = np.array([0, 4, 17, 30, 45, 60, 89])
+		parts = field.split(rows)
+		equal_int('split cover', sorted(np.concatenate(parts).tolist()), rows.tolist())
+		equal_int('split by sector', all(len(set(field.region_of[p].tolist())) == 1 for p in parts), True)
+		equal_int('split empty', field.split(np.zeros(0, dtype=np.intp)), [])
+
+def test_parallel_matches_serial():
+	import land as ld
+	import living as lv
+	import random
+	rand = random.Random(0)
+	serial = ld.Land(5, 800, 20)
+	parallel = ld.Land(5, 800, 20)
+	with ParallelSmellField(parallel, 3, capacity=2) as field:
+		parallel.attach_field(field)
+		livings = [lv.Living(i, 'Test Living {}'.format(i), serial.map[(0, 0)]) for i in range(5)]
+		for tick in range(8):
+			for l in livings:
+				p = rand.choice(serial.cells)
+				serial.map[p].smells[l] = l.generateSmell()
+				parallel.map[p].smells[l] = l.generateSmell()
+			serial.field.emit(serial.map[p].cell, livings[tick % 5], 100, fd.Sound)
+			field.emit(parallel.map[p].cell, livings[tick % 5], 100, fd.Sound)
+			serial.field.step()
+			parallel.field.step()
+			n = len(field.sources)
+			equal_int('parallel strengths', (serial.field.strength[:, :n] == field.strength[:, :n]).all(), True)
+			equal_int('parallel active', sorted(serial.field.active.tolist()), sorted(field.active.tolist()))
+
+def test_mapped_checkpoint():
+	import checkpoint as cp
+	import engine as en
+	import land as ld
+	import os
+	import storage as st
+	import tempfile
+	with tempfile.TemporaryDirectory() as tmp:
+		land = ld.Land(5, 800, 20, storage=st.Mapped(os.path.join(tmp, 'world')))
+		livings = en.populate(land, 6)
+		with ParallelSmellField(land, 2) as field:
+			land.attach_field(field)
+			en.run(land, livings, 3)
+			cp.save(os.path.join(tmp, 'world.npz'), land, livings)
+			files = sorted(f.split('-')[0] for f in os.listdir(os.path.join(tmp, 'world')))
+			equal_int('parallel storage released', files, ['passable'])
+			restored, restored_livings = cp.load(os.path.join(tmp, 'world.npz'))
+			n = len(field.sources)
+			equal_int('parallel checkpoint', (restored.field.strength[:, :n] == field.strength[:, :n]).all(), True)
+
+def test_resume():
+	import checkpoint as cp
+	import engine as en
+	import land as ld
+	import os
+	import tempfile
+	land = ld.Land(4, 800, 20, seed=5)
+	livings = en.populate(land, 20)
+	en.run(land, livings, 6)
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, 'world.npz')
+		cp.save(path, land, livings)
+		serial = cp.load(path)
+		resumed = cp.load(path)
+	field = en.parallelize(resumed[0], 2)
+	try:
+		equal_int('parallel adopts', (field.strength == serial[0].field.strength[:, :field.strength.shape[1]]).all(), True)
+		equal_int('parallel resumed', en.replay([serial, resumed], 8), None)
+	finally:
+		field.close()
+
+def test_all():
+	test_sectors()
+	test_split()
+	test_parallel_matches_serial()
+	test_mapped_checkpoint()
+	test_resume()
+
+if __name__ == '__main__':
+	test_all()
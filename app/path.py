@@ -0,0 +1,195 @@
+# pathfinding on a Land: A* between two terrains and multi-source BFS distance
+# fields that any number of livings heading for the same targets can share.
+# Both are cached until the land's passability changes.
+import collections
+import heapq
+import numpy as np
+from typing import Dict, Iterable, List
+
+Unreachable = -1
+
+class Pathfinder:
+	def __init__(self, land:'ld.Land', cache_size:int = 256):
+		self.land = land
+		self.index = land.index
+		self.cache_size = cache_size
+		self.version = land.version
+		self.fields = collections.OrderedDict() #Dict[(frozenset, int), np.ndarray], least recently used first
+		self.paths = collections.OrderedDict() #Dict[(int, int), List[int]]
+
+	def __repr__(self):
+		return 'Pathfinder(fields:{}, paths:{})'.format(len(self.fields), len(self.paths))
+
+	def check_version(self):
+		# any change to the terrain invalidates every cached field and path
+		if self.version != self.land.version:
+			self.fields.clear()
+			self.paths.clear()
+			self.version = self.land.version
+
+	def remember(self, cache:collections.OrderedDict, key:'Any', value:'Any'):
+		cache[key] = value
+		if len(cache) > self.cache_size:
+			cache.popitem(last=False)
+
+	def distance_field(self, targets:Iterable['te.Terrain'], reach:int = None):
+		# steps from every cell to the nearest target, Unreachable where blocked
+		# off or, with 'reach', more than that many steps away
+		self.check_version()
+		cells = frozenset(t.cell for t in targets)
+		key = (cells, reach)
+		if key in self.fields:
+			self.fields.move_to_end(key)
+			return self.fields[key]
+
+		land = self.land
+		size = len(land.cells)
+		passable = np.append(land.passable, False) # the missing-neighbor id lands on False
+		distances = np.full(size, Unreachable, dtype=np.int32)
+		frontier = np.array([c for c in cells if land.passable[c]], dtype=np.intp)
+		distances[frontier] = 0
+		steps = 0
+		while len(frontier) and (reach is None or steps < reach):
+			steps += 1
+			candidates = np.unique(land.neighbors_of(frontier).ravel())
+			candidates = candidates[passable[candidates]]
+			frontier = candidates[distances[candidates] == Unreachable]
+			distances[frontier] = steps
+
+		self.remember(self.fields, key, distances)
+		return distances
+
+	def descend(self, distances:np.ndarray, start:'te.Terrain', limit:int = None):
+		# path following the field downhill from start, excluding start itself
+		land = self.land
+		cell = start.cell
+		if distances[cell] == Unreachable:
+			return []
+		size = len(land.cells)
+		path = []
+		while distances[cell] > 0 and (limit is None or len(path) < limit):
+			downhill = distances[cell] - 1
+			cell = next(n for n in land.neighbors(cell) if n < size and distances[n] == downhill)
+			path.append(land.terrains[cell])
+		return path
+
+	def heuristic(self, a:int, b:int, coords:Dict[int, tuple]):
+		# hex distance; 'coords' memoizes the (q, r) of every cell looked at
+		if a not in coords:
+			coords[a] = self.index.coord(a)
+		if b not in coords:
+			coords[b] = self.index.coord(b)
+		aq, ar = coords[a]
+		bq, br = coords[b]
+		dq = aq - bq
+		dr = ar - br
+		return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
+	def astar(self, start:'te.Terrain', goal:'te.Terrain'):
+		# shortest path from start to goal, excluding start; [] if there is none
+		self.check_version()
+		key = (start.cell, goal.cell)
+		if key in self.paths:
+			self.paths.move_to_end(key)
+			return [self.land.terrains[c] for c in self.paths[key]]
+
+		land = self.land
+		size = len(land.cells)
+		passable = land.passable
+		coords = {}
+		came_from = {start.cell: None}
+		cost = {start.cell: 0}
+		frontier = [(self.heuristic(start.cell, goal.cell, coords), 0, start.cell)]
+		found = start.cell == goal.cell
+		while frontier and not found:
+			f, g, cell = heapq.heappop(frontier)
+			if g > cost[cell]:
+				continue
+			for n in land.neighbors(cell):
+				if n >= size or not passable[n]:
+					continue
+				if n not in cost or g + 1 < cost[n]:
+					cost[n] = g + 1
+					came_from[n] = cell
+					if n == goal.cell:
+						found = True
+						break
+					heapq.heappush(frontier, (g + 1 + self.heuristic(n, goal.cell, coords), g + 1, n))
+
+		cells = []
+		if found:
+			cell = goal.cell
+			while cell != start.cell:
+				cells.append(cell)
+				cell = came_from[cell]
+			cells.reverse()
+		self.remember(self.paths, key, cells)
+		return [land.terrains[c] for c in cells]
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_distance_field():
+	import land as ld
+	land = ld.Land(5, 800, 20)
+	paths = land.paths
+	target = land.map[(0, 0)]
+	distances = paths.distance_field([target])
+	for t in land.terrains:
+		equal_int('field distance', distances[t.cell], t.polygon.distanceTo(target.polygon))
+	equal_int('field cached', paths.distance_field([target]) is distances, True)
+	near = paths.distance_field([target], reach=2)
+	equal_int('field reach', sorted(set(near.tolist())), [Unreachable, 0, 1, 2])
+
+	start = land.map[(3, -1)]
+	path = paths.descend(distances, start)
+	equal_int('descend length', len(path), 3)
+	equal_int('descend end', path[-1], target)
+
+def test_astar():
+	import land as ld
+	land = ld.Land(5, 800, 20)
+	start = land.map[(-3, 0)]
+	goal = land.map[(3, 0)]
+	equal_int('astar open', len(land.paths.astar(start, goal)), 6)
+
+	# a wall across the middle, with a gap at the top
+	for r in range(-4, 6):
+		land.set_passable(land.map[(0, r)], False)
+	path = land.paths.astar(start, goal)
+	equal_int('astar detour', len(path) > 6, True)
+	equal_int('astar avoids wall', all(t.passable for t in path), True)
+	equal_int('astar steps', all(a.polygon.distanceTo(b.polygon) == 1 for a, b in zip([start] + path, path)), True)
+	equal_int('field detour', land.paths.distance_field([goal])[start.cell], len(path))
+
+	land.set_passable(land.map[(0, -5)], False)
+	equal_int('astar blocked', land.paths.astar(start, goal), [])
+	equal_int('field blocked', land.paths.distance_field([goal])[start.cell], Unreachable)
+
+def test_shared_field():
+	import land as ld
+	import living as lv
+	land = ld.Land(5, 800, 20)
+	prey = land.map[(0, 0)]
+	hunters = [lv.Living(i, 'Hunter {}'.format(i), t) for i, t in enumerate(land.terrains[:20])]
+	for h in hunters:
+		h.path_towards([prey], steps=1)
+	equal_int('shared field', len(land.paths.fields), 1)
+	equal_int('shared steps', all(len(h.path) == 1 for h in hunters if h.position != prey), True)
+	hunters[0].path_to(prey)
+	equal_int('path_to', hunters[0].path[-1], prey)
+
+def test_all():
+	test_distance_field()
+	test_astar()
+	test_shared_field()
+
+if __name__ == '__main__':
+	test_all()
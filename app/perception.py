@@ -0,0 +1,129 @@
+# what every living can sense within a radius, answered for all of them at
+# once each tick. The spiral of offsets is walked once and shared; livings on
+# the same cell share one query, and each cell's occupants are listed once.
+import field as fd
+import hexarray as ha
+import numpy as np
+from typing import Dict, Iterable, List
+
+class Perception:
+	def __init__(self, land:'ld.Land', radius:int = 3, channels:Iterable['fd.Channel'] = None):
+		self.land = land
+		self.radius = radius
+		self.channels = (fd.Sound, fd.Light) if channels is None else tuple(channels)
+		self.dq, self.dr = ha.spiral_offsets(radius)
+		self.tick = None
+		self.rows = {} #Dict[int, int], living row -> query row
+		self.cells = np.zeros(0, dtype=np.intp) #observed cell of every query row
+		self.by_order = [] #List[Living], sorted by cell
+		self.starts = self.ends = np.zeros((0, 0), dtype=np.intp) #by_order slice of each area cell, by query row
+		self.seen = {} #Dict[int, List[Living]], query row -> livings in range, built when first asked
+		self.loudest = {} #Dict[Channel, (cells, strengths)], by query row
+
+	def __repr__(self):
+		return 'Perception(radius:{}, observers:{}, cells:{})'.format(self.radius, len(self.rows), len(self.cells))
+
+	def update(self, livings:Iterable['lv.Living']):
+		land = self.land
+		store = land.entities
+		livings = list(livings)
+		rows = store.rows(livings)
+		if len(rows) == 0:
+			self.rows, self.cells, self.by_order, self.seen, self.loudest = {}, np.zeros(0, dtype=np.intp), [], {}, {}
+			self.starts = self.ends = np.zeros((0, 0), dtype=np.intp)
+			self.tick = land.tick
+			return
+
+		# one query per occupied cell
+		self.cells, inverse = np.unique(store.seen_cell[rows], return_inverse=True)
+		self.rows = dict(zip(rows.tolist(), inverse.ravel().tolist()))
+		q, r = land.index.coords(self.cells)
+		area = land.index.cell_ids(q[:, None] + self.dq, r[:, None] + self.dr) #(queries, spiral), len(cells) off the map
+
+		# occupants of every cell, listed once: livings sorted by cell. The lists
+		# of who is in range are only made for the queries visible() is asked
+		order = np.argsort(store.seen_cell[rows], kind='stable')
+		sorted_cells = store.seen_cell[rows][order]
+		self.starts = np.searchsorted(sorted_cells, area, side='left')
+		self.ends = np.searchsorted(sorted_cells, area, side='right')
+		self.by_order = [livings[i] for i in order.tolist()]
+		self.seen = {}
+
+		# the loudest hex of each channel in range, one gather per channel
+		field = land.field
+		self.loudest = {}
+		for channel in self.channels:
+			col = field.columns.get(field.key(None, channel))
+			if col is None:
+				continue
+			strengths = field.strength[area, col]
+			loudest = strengths.argmax(axis=1)
+			self.loudest[channel] = (area[np.arange(len(area)), loudest], strengths[np.arange(len(area)), loudest])
+		self.tick = land.tick
+
+	def visible(self, l:'lv.Living'):
+		# other livings within the radius
+		query = self.rows.get(l.row)
+		if query is None:
+			return []
+		seen = self.seen.get(query)
+		if seen is None:
+			by_order = self.by_order
+			seen = [x for s, e in zip(self.starts[query].tolist(), self.ends[query].tolist()) if e > s for x in by_order[s:e]]
+			self.seen[query] = seen
+		return [x for x in seen if x is not l]
+
+	def loudest_cell(self, l:'lv.Living', channel:'fd.Channel'):
+		# (cell, strength) of the strongest signal in range, None when there is none
+		query = self.rows.get(l.row)
+		if query is None or channel not in self.loudest:
+			return None
+		cells, strengths = self.loudest[channel]
+		return (int(cells[query]), int(strengths[query])) if strengths[query] > 0 else None
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_visible():
+	import land as ld
+	import living as lv
+	land = ld.Land(10, 800, 20)
+	rand = np.random.default_rng(0)
+	livings = [lv.Living(i, 'Test Living {}'.format(i), land.terrains[int(c)]) for i, c in enumerate(rand.integers(0, len(land.cells), 80))]
+	land.entities.swap()
+	perception = Perception(land, radius=2)
+	perception.update(livings)
+	equal_int('perception lazy', perception.seen, {})
+	for l in livings:
+		expected = sorted(x.uid for x in land.in_range(l.position, 2) if x is not l)
+		equal_int('perception visible', sorted(x.uid for x in perception.visible(l)), expected)
+
+def test_loudest():
+	import land as ld
+	import living as lv
+	land = ld.Land(10, 800, 20)
+	listener = lv.Living(0, 'Listener', land.map[(0, 0)])
+	fighter = lv.Living(1, 'Fighter', land.map[(3, 0)])
+	land.field.emit(fighter.position.cell, fighter, 100, fd.Sound)
+	land.field.step()
+	land.entities.swap()
+	perception = Perception(land, radius=2)
+	perception.update([listener, fighter])
+	cell, strength = perception.loudest_cell(listener, fd.Sound)
+	equal_int('perception loudest', land.cells[cell].distanceTo(land.map[(3, 0)].polygon), 1)
+	equal_int('perception strength', strength, 100 - fd.Sound.decay - fd.Sound.attenuation)
+	equal_int('perception silence', perception.loudest_cell(listener, fd.Light), None)
+
+def test_all():
+	test_visible()
+	test_loudest()
+
+if __name__ == '__main__':
+	test_all()
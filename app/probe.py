@@ -0,0 +1,99 @@
+# opt-in per-phase timers and counters for the tick loop and the renderer.
+# Callers pass a Probe where they want measurements and None otherwise, so an
+# uninstrumented tick only pays for the 'is None' check.
+import collections
+import json
+import time
+from typing import Callable, Dict
+
+class Probe:
+	def __init__(self, log_every:int = 0, log:Callable[[str], None] = print, trace:bool = False):
+		self.log_every = log_every
+		self.log = log
+		self.trace = [] if trace else None
+		self.clock = time.perf_counter
+		self.origin = self.clock()
+		self.reset()
+
+	def __repr__(self):
+		return 'Probe(ticks:{}, phases:{})'.format(self.ticks, len(self.timers))
+
+	def __str__(self):
+		return self.report()
+
+	def reset(self):
+		self.ticks = 0
+		self.timers = collections.defaultdict(float) #Dict[str, float] seconds per phase
+		self.calls = collections.Counter() #Dict[str, int] calls per phase
+		self.counters = collections.Counter() #Dict[str, int]
+
+	def begin(self, phase:str):
+		return self.clock()
+
+	def end(self, phase:str, start:float):
+		stop = self.clock()
+		self.timers[phase] += stop - start
+		self.calls[phase] += 1
+		if self.trace is not None:
+			self.trace.append({'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0,
+							'ts': (start - self.origin) * 1e6, 'dur': (stop - start) * 1e6})
+
+	def count(self, counter:str, n:int = 1):
+		self.counters[counter] += n
+
+	def end_tick(self):
+		self.ticks += 1
+		if self.log_every and self.ticks % self.log_every == 0:
+			self.log(self.report())
+
+	def summary(self):
+		ticks = max(self.ticks, 1)
+		return {
+			'ticks': self.ticks,
+			'phase_s': dict(self.timers),
+			'phase_s_per_tick': {k:v / ticks for k, v in self.timers.items()},
+			'calls': dict(self.calls),
+			'counters': dict(self.counters),
+		}
+
+	def report(self):
+		ticks = max(self.ticks, 1)
+		phases = ', '.join('{} {:.2f}ms'.format(k, v * 1000 / ticks) for k, v in self.timers.items())
+		counters = ', '.join('{} {:.1f}'.format(k, v / ticks) for k, v in self.counters.items())
+		return 'tick {}: {} | per tick: {}'.format(self.ticks, phases, counters)
+
+	def export_trace(self, path:str):
+		# Chrome trace event format, open in chrome://tracing or Perfetto
+		with open(path, 'w') as f:
+			json.dump({'traceEvents': self.trace or [], 'displayTimeUnit': 'ms'}, f)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_probe():
+	lines = []
+	probe = Probe(log_every=2, log=lines.append, trace=True)
+	for i in range(4):
+		start = probe.begin('phase')
+		probe.end('phase', start)
+		probe.count('things', 3)
+		probe.end_tick()
+	summary = probe.summary()
+	equal_int('probe ticks', summary['ticks'], 4)
+	equal_int('probe calls', summary['calls']['phase'], 4)
+	equal_int('probe counters', summary['counters']['things'], 12)
+	equal_int('probe log', len(lines), 2)
+	equal_int('probe trace', len(probe.trace), 4)
+
+def test_all():
+	test_probe()
+
+if __name__ == '__main__':
+	test_all()
@@ -0,0 +1,101 @@
+# per-world random numbers. Every draw in a world comes from its own seeded
+# stream, so a run is reproduced exactly by its seed, independent of anything
+# else in the process that uses the random module.
+import numpy as np
+from typing import Any, Dict, List, Sequence
+
+class Stream:
+	# uniform floats are drawn from NumPy in batches of 'batch' and handed out
+	# one at a time; the values do not depend on the batch size
+	def __init__(self, seed:'Any' = 0, batch:int = 4096):
+		self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+		self.generator = np.random.Generator(np.random.PCG64(self.seed))
+		self.batch = batch
+		self.buffer = []
+		self.next = 0
+
+	def __repr__(self):
+		return 'Stream(entropy:{}, buffered:{})'.format(self.seed.entropy, len(self.buffer) - self.next)
+
+	def spawn(self, count:int):
+		# independent child streams, one per worker process
+		return [Stream(s, self.batch) for s in self.seed.spawn(count)]
+
+	def reserve(self, count:int):
+		# makes sure the next 'count' draws are buffered, fetching the shortfall
+		# in one vectorized call; the engine reserves a tick's worth up front
+		available = len(self.buffer) - self.next
+		if available < count:
+			self.buffer = self.buffer[self.next:] + self.generator.random(max(count - available, self.batch)).tolist()
+			self.next = 0
+
+	def random(self):
+		if self.next == len(self.buffer):
+			self.reserve(1)
+		u = self.buffer[self.next]
+		self.next += 1
+		return u
+
+	def choice(self, seq:Sequence):
+		return seq[int(self.random() * len(seq))]
+
+	def integers(self, high:int, count:int):
+		# 'count' ints in [0, high) at once, for batch decisions like directions
+		self.reserve(count)
+		u = np.array(self.buffer[self.next:self.next + count])
+		self.next += count
+		return (u * high).astype(np.int64)
+
+	def state(self):
+		# JSON-friendly, with the buffered draws that were not handed out yet
+		return {'generator': self.generator.bit_generator.state, 'buffer': self.buffer[self.next:]}
+
+	def set_state(self, state:Dict[str, 'Any']):
+		self.generator.bit_generator.state = state['generator']
+		self.buffer = list(state['buffer'])
+		self.next = 0
+
+# for livings that are not placed on a Land
+unplaced = Stream(0)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_batches():
+	small = Stream(7, batch=3)
+	large = Stream(7, batch=1000)
+	large.reserve(50)
+	equal_int('batch independent', [small.random() for i in range(20)], [large.random() for i in range(20)])
+	equal_int('seeded', Stream(7).choice(range(100)), Stream(7).choice(range(100)))
+	directions = Stream(7).integers(6, 1000)
+	equal_int('integers range', (directions.min(), directions.max()), (0, 5))
+
+def test_spawn():
+	a, b = Stream(3).spawn(2)
+	equal_int('spawn independent', a.random() != b.random(), True)
+	equal_int('spawn reproducible', Stream(3).spawn(2)[1].random(), Stream(3).spawn(2)[1].random())
+
+def test_state():
+	import json
+	s = Stream(5)
+	s.random()
+	state = json.loads(json.dumps(s.state()))
+	expected = [s.random() for i in range(10)]
+	restored = Stream(0)
+	restored.set_state(state)
+	equal_int('state round trip', [restored.random() for i in range(10)], expected)
+
+def test_all():
+	test_batches()
+	test_spawn()
+	test_state()
+
+if __name__ == '__main__':
+	test_all()
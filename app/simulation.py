@@ -2,10 +2,16 @@ import pygame as pg
 import terrain as te
 import land as ld
 import living as lv
+import engine as en
+import field as fd
+import hex as pl
 
+import asyncio
 import collections
-from typing import Dict, List, Iterable
-from dataclasses import dataclass
+import hexarray as ha
+import numpy as np
+from typing import Dict, List, Iterable, Tuple
+from dataclasses import dataclass, field
 
 Point = collections.namedtuple('Point', ('x', 'y'))
 
@@ -18,7 +24,13 @@ class Terrain_package:
 class Land_package:
 	land: ld.Land
 	color: pg.Color
-	redraw: bool = True
+	redraw: bool = True # repaint the whole screen, not just what changed
+	corners: Dict[te.Terrain, List[Point]] = None # computed once per layout
+	rects: Dict[te.Terrain, pg.Rect] = None
+	terrains: List[te.Terrain] = None # every terrain by cell, listed before the world starts
+	grid: pg.Surface = None # the static hex outlines, black is transparent
+	smell_layer: pg.Surface = None # highlight fills, kept between frames
+	painted: Dict[te.Terrain, pg.Color] = field(default_factory=dict) # what smell_layer holds
 
 @dataclass
 class Living_package:
@@ -26,8 +38,22 @@ class Living_package:
 	color: pg.Color
 	img: pg.Surface
 	redraw: bool = True
+	rect: pg.Rect = None # where it was last drawn
+
+@dataclass
+class Snapshot:
+	# what the renderer needs of one completed tick
+	tick: int
+	positions: Dict[lv.Living, te.Terrain]
+	smells: List[Tuple[te.Terrain, lv.Living, int]] # strongest scent on every smelly hex
 
-def main():
+@dataclass
+class Session:
+	snapshot: Snapshot # the latest completed tick, replaced whole by the tick task
+	events: List = field(default_factory=list) # input the renderer has not handled yet
+	running: bool = True
+
+def main(probe:'pr.Probe' = None):
 
 	screen_size = 800
 	land_radius = 5
@@ -37,29 +63,91 @@ def main():
 
 	land_pack, life_packs = initialize_world(screen_size, land_radius)
 
-	clock = pg.time.Clock()
 	screen = pg.display.set_mode((screen_size, screen_size))
-
-	elapsed_time = 0
-	while True:
-		events = pg.event.get()
-		terrain_highlights = {}
-
-		for e in events:
-			if e.type == pg.QUIT:
-				return
-		
-		elapsed_time += clock.get_time()
-		q, mod = divmod(elapsed_time, world_pace_ms)
-		if (q >= 1):
-			print('elapsed_time: {}'.format(elapsed_time))
-			print('q: {}, mod: {}'.format(q, mod))
-			for i in range(q):
-				update_world(life_packs, land_pack)
-			elapsed_time = mod
-		terrain_highlights = handle_events(events, land_pack, life_packs)
-		draw(screen, land_pack, life_packs, terrain_highlights)
-		clock.tick(60)
+	asyncio.run(run(screen, land_pack, life_packs, world_pace_ms, probe))
+
+async def run(screen:pg.Surface,
+			land_pack:Land_package,
+			life_packs:Dict[lv.Living, Living_package],
+			world_pace_ms:int,
+			probe:'pr.Probe' = None,
+			frame_ms:int = 16,
+			input_ms:int = 8
+			):
+	# ticks, frames and input each run at their own pace. Ticks happen in a
+	# worker thread and only hand over finished snapshots, so a slow tick
+	# never holds up a frame and a slow frame never holds up the world.
+	# Every terrain is created here, before the world starts moving.
+	build_layers(screen, land_pack)
+	session = Session(snapshot(land_pack.land, life_packs.keys()))
+	await asyncio.gather(tick_loop(session, land_pack, life_packs, world_pace_ms, probe),
+						render_loop(session, screen, land_pack, life_packs, frame_ms, probe),
+						input_loop(session, input_ms))
+
+async def tick_loop(session:Session,
+					land_pack:Land_package,
+					life_packs:Dict[lv.Living, Living_package],
+					world_pace_ms:int,
+					probe:'pr.Probe' = None
+					):
+	loop = asyncio.get_running_loop()
+	due = loop.time()
+	try:
+		while session.running:
+			due += world_pace_ms / 1000
+			behind = loop.time() - due
+			if behind > 0:
+				# catching up one tick at a time, frames go on in between
+				land_pack.land.events.debug(None, 'catch_up', behind_ms=round(behind * 1000))
+			await asyncio.sleep(max(0.0, -behind))
+			if session.running:
+				session.snapshot = await asyncio.to_thread(update_world, life_packs, land_pack, probe)
+	finally:
+		session.running = False
+
+async def render_loop(session:Session,
+					screen:pg.Surface,
+					land_pack:Land_package,
+					life_packs:Dict[lv.Living, Living_package],
+					frame_ms:int,
+					probe:'pr.Probe' = None
+					):
+	drawn = None
+	try:
+		while session.running:
+			events, session.events = session.events, []
+			snapshot = session.snapshot
+			if snapshot is not drawn:
+				for l_pack in life_packs.values():
+					l_pack.redraw = True
+				drawn = snapshot
+
+			if probe is None:
+				terrain_highlights = handle_events(events, land_pack, life_packs, snapshot)
+				draw(screen, land_pack, life_packs, terrain_highlights, snapshot)
+			else:
+				start = probe.begin('handle_events')
+				terrain_highlights = handle_events(events, land_pack, life_packs, snapshot)
+				probe.end('handle_events', start)
+				probe.count('hexes_highlighted', len(terrain_highlights))
+				start = probe.begin('draw')
+				draw(screen, land_pack, life_packs, terrain_highlights, snapshot)
+				probe.end('draw', start)
+			await asyncio.sleep(frame_ms / 1000)
+	finally:
+		session.running = False
+
+async def input_loop(session:Session, input_ms:int):
+	try:
+		while session.running:
+			for e in pg.event.get():
+				if e.type == pg.QUIT:
+					session.running = False
+				else:
+					session.events.append(e)
+			await asyncio.sleep(input_ms / 1000)
+	finally:
+		session.running = False
 
 def living_img(text:str, text_size:int):
 	font = pg.font.SysFont(None, text_size)
@@ -70,59 +158,43 @@ def initialize_world(screen_size:int, land_radius:int):
 	land_pack = Land_package(land = ld.Land(land_radius, screen_size, 20),
 				color = pg.Color(255, 255, 255))
 
+	colors = (pg.Color(0, 255, 0), pg.Color(255, 0, 0), pg.Color(0, 0, 255))
 	life_packs = {}
-
-	pos1 = land_pack.land.map[(0, 0)]
-	l1 = lv.Living('Adam', 'Adam', pos1)
-	l1.state = lv.LivingState.SEARCHING
-	p10 = list(l1.position.neighbors.values())[0]
-	p11 = list(p10.neighbors.values())[0]
-	p12 = list(p11.neighbors.values())[0]
-	p13 = list(p12.neighbors.values())[0]
-	l1.path = [p10, p11, p12, p13]
-	life_packs[l1] = Living_package(living = l1,
-							color = pg.Color(0, 255, 0),\
-							img = living_img(l1.uid, land_pack.land.terrain_size))
-
-	pos2 = list(land_pack.land.map.values())[-10]
-	l2 = lv.Living('Eve', 'Eve', pos2)
-	life_packs[l2] = Living_package(living = l2,
-							color = pg.Color(255, 0, 0),
-							img = living_img(l2.uid, land_pack.land.terrain_size))
-
-	pos3 = list(land_pack.land.map.values())[12]
-	l3 = lv.Living('Plissken', 'Plissken', pos3)
-	life_packs[l3] = Living_package(living = l3,
-							color = pg.Color(0, 0, 255),
-							img = living_img(l3.uid, land_pack.land.terrain_size))
+	for l, color in zip(en.default_livings(land_pack.land), colors):
+		life_packs[l] = Living_package(living = l,
+								color = color,
+								img = living_img(l.uid, land_pack.land.terrain_size))
 
 	return land_pack, life_packs
 
 def update_world(life_packs: Dict[lv.Living, Living_package],
-				land_pack:Land_package
+				land_pack:Land_package,
+				probe:'pr.Probe' = None
 				):
-
-	for terrain in land_pack.land.map.values():
-		terrain.decay()
-		terrain.broadcast()
-
-	for terrain in land_pack.land.map.values():
-		terrain.update()
-
-	life_packs = {l:i for l,i in life_packs.items() if l.state != lv.LivingState.DEAD}
-
-	for l, l_info in life_packs.items():
-		l.move()
-		l_info.redraw = True
-
-	for l, l_info in life_packs.items():
-		l.act()
-
-	land_pack.redraw = True
+	# runs on the tick thread: the world is only read here, never by the renderer
+	en.update_world(land_pack.land, life_packs.keys(), probe)
+	return snapshot(land_pack.land, life_packs.keys())
+
+def snapshot(land:ld.Land, livings:Iterable[lv.Living]):
+	# only cells holding smell can be highlighted
+	smells = land.field
+	n = len(smells.sources)
+	strongest_smells = []
+	if n > 0:
+		cells = smells.occupied()
+		scent = np.array([c is fd.Scent for c in smells.channels])
+		strengths = np.where(scent, smells.strength[cells, :n], 0)
+		strongest = strengths.argmax(axis=1)
+		max_strengths = strengths[np.arange(len(cells)), strongest]
+		for cell, col, max_smell_strength in zip(cells.tolist(), strongest.tolist(), max_strengths.tolist()):
+			if max_smell_strength > 0:
+				strongest_smells.append((land.terrains[cell], smells.sources[col], max_smell_strength))
+	return Snapshot(land.tick, {l:l.position for l in livings}, strongest_smells)
 
 def handle_events(events:List,
 				land_pack:Land_package,
-				life_packs:Dict[lv.Living, Living_package]
+				life_packs:Dict[lv.Living, Living_package],
+				snapshot:Snapshot
 				):
 
 	t_highlights = {}
@@ -130,66 +202,124 @@ def handle_events(events:List,
 		if e.type == pg.MOUSEBUTTONDOWN: # move to update_state
 			if e.button == 1: # left click
 				p = Point(*pg.mouse.get_pos())
-				tar_terrain = land_pack.land.pixel_to_terrain(p)
-				tar_terrain_neighbors = tar_terrain.neighbors if tar_terrain is not None else {}
 				h_color = pg.Color(100, 100, 100)
-				t_highlights = {t:Terrain_package(terrain = t, color = h_color) for (k, t) in tar_terrain_neighbors.items()}
-				land_pack.redraw = True
-				for living_info in life_pack.values():
-					living_info.redraw = True
-
-	
-	for t in land_pack.land.map.values():
-		if t.smells:
-			max_smell_strength = max(s.strength for s in t.smells.values())
-			strongest_smell = next(smell for smell in t.smells.values() if smell.strength == max_smell_strength)
-			l = strongest_smell.source
-			color = pg.Color(life_packs[l].color)
-			inv_strength = round((100 -  max_smell_strength) * 2.55)
-			color.r = max(0, color.r - inv_strength)
-			color.g = max(0, color.g - inv_strength)
-			color.b = max(0, color.b - inv_strength)
-			t_highlights[t] = Terrain_package(terrain = t, color = color)
+				t_highlights = {t:Terrain_package(terrain = t, color = h_color) for t in clicked_neighbors(land_pack, p)}
+
+	for t, source, max_smell_strength in snapshot.smells:
+		color = pg.Color(life_packs[source].color)
+		inv_strength = round((100 -  max_smell_strength) * 2.55)
+		color.r = max(0, color.r - inv_strength)
+		color.g = max(0, color.g - inv_strength)
+		color.b = max(0, color.b - inv_strength)
+		t_highlights[t] = Terrain_package(terrain = t, color = color)
 
 	return t_highlights
-	
+
+def clicked_neighbors(land_pack:Land_package, p:Point):
+	# the terrains around the hex under 'p'. The live land belongs to the tick
+	# thread, so this only reads what never changes once the world runs: the
+	# layout, the cell index and the terrains listed by build_layers
+	land = land_pack.land
+	h = pl.pixel_to_hex(land.layout, p)
+	cell = land.index.cell_id(h.q, h.r)
+	if cell is None:
+		return []
+	size = len(land_pack.terrains)
+	return [land_pack.terrains[n] for n in land.index.neighbors(cell) if n < size]
+
 
 def draw(screen:pg.Surface,
 		land_pack:Land_package,
 		life_packs: Dict[lv.Living, Living_package],
-		terrain_highlights:Dict[te.Terrain, Terrain_package]
+		terrain_highlights:Dict[te.Terrain, Terrain_package],
+		snapshot:Snapshot
 		):
 
-	if land_pack.redraw or any(l_pack.redraw for l_pack in life_packs.values()):
-		screen.fill((0, 0, 0))
-		draw_highlighted_terrain(screen, terrain_highlights, land_pack.land)
-		draw_life(screen, life_packs, land_pack.land)
-		draw_land(screen, land_pack)
-		pg.display.flip()
+	if land_pack.grid is None:
+		build_layers(screen, land_pack)
 
-def draw_land(screen:pg.Surface, land_pack:Land_package):
+	dirty = paint_highlights(land_pack, terrain_highlights)
+	dirty += move_life(life_packs, land_pack.land, snapshot)
 	if land_pack.redraw:
-		for t in land_pack.land.map.values():
-			pg.draw.polygon(screen, land_pack.color, land_pack.land.polygon_corners(t), width=1)
+		dirty = [screen.get_rect()]
 		land_pack.redraw = False
+	if not dirty:
+		return
+
+	# a living overlapping a dirty rect is drawn again, so its whole rect is restored
+	overlapping = True
+	while overlapping:
+		overlapping = [l_pack.rect for l_pack in life_packs.values()
+						if l_pack.rect.collidelist(dirty) != -1 and l_pack.rect not in dirty]
+		dirty += overlapping
+
+	for rect in dirty:
+		screen.blit(land_pack.smell_layer, rect, rect)
+	draw_life(screen, life_packs, dirty)
+	for rect in dirty:
+		screen.blit(land_pack.grid, rect, rect)
+	pg.display.update(dirty)
+
+def build_layers(screen:pg.Surface, land_pack:Land_package):
+	# every hex's corners at once; the cos/sin run six times in total
+	land = land_pack.land
+	q, r = land.index.coords(np.arange(len(land.index)))
+	corners = ha.polygon_corners(land.layout, q, r)
+	low = corners.min(axis=1)
+	size = corners.max(axis=1) - low
+	land_pack.corners = {}
+	land_pack.rects = {}
+	land_pack.terrains = list(land.terrains)
+	for t, t_corners, t_low, t_size in zip(land.terrains, corners.tolist(), low.tolist(), size.tolist()):
+		land_pack.corners[t] = [Point(*c) for c in t_corners]
+		land_pack.rects[t] = pg.Rect(t_low, t_size).inflate(4, 4)
+
+	land_pack.grid = pg.Surface(screen.get_size())
+	land_pack.grid.set_colorkey((0, 0, 0))
+	for t in land.terrains:
+		pg.draw.polygon(land_pack.grid, land_pack.color, land_pack.corners[t], width=1)
+
+	land_pack.smell_layer = pg.Surface(screen.get_size())
+	land_pack.painted = {}
+	land_pack.redraw = True
 
-def draw_highlighted_terrain(screen:pg.Surface, terrain:Dict[te.Terrain, Terrain_package], land:ld.Land):
+def paint_highlights(land_pack:Land_package, terrain:Dict[te.Terrain, Terrain_package]):
+	# repaints only hexes whose highlight changed, returns their rects
+	dirty = []
+	for t in [t for t in land_pack.painted if t not in terrain]:
+		pg.draw.polygon(land_pack.smell_layer, (0, 0, 0), land_pack.corners[t], width=0)
+		del land_pack.painted[t]
+		dirty.append(land_pack.rects[t])
 	for t, t_info in terrain.items():
-		pg.draw.polygon(screen, t_info.color, land.polygon_corners(t), width=0)
-
-def draw_life(screen:pg.Surface, life_packs:Dict[lv.Living, Living_package], land:ld.Land):
+		if land_pack.painted.get(t) != t_info.color:
+			pg.draw.polygon(land_pack.smell_layer, t_info.color, land_pack.corners[t], width=0)
+			land_pack.painted[t] = t_info.color
+			dirty.append(land_pack.rects[t])
+	return dirty
+
+def move_life(life_packs:Dict[lv.Living, Living_package], land:ld.Land, snapshot:Snapshot):
+	# returns the rects livings left and entered
+	dirty = []
 	for liv, l_pack in life_packs.items():
-		if l_pack.redraw:
-			draw_living(screen, liv.position, l_pack.color, l_pack.img, land)
+		if l_pack.redraw or l_pack.rect is None:
+			rect = living_rect(snapshot.positions[liv], l_pack.img, land)
+			if rect != l_pack.rect:
+				if l_pack.rect is not None:
+					dirty.append(l_pack.rect)
+				dirty.append(rect)
+				l_pack.rect = rect
 			l_pack.redraw = False
+	return dirty
 
-def draw_living(screen:pg.Surface, position:te.Terrain, color:pg.Color, img:pg.Surface, land:ld.Land):
-	#pg.draw.polygon(screen, color, land.polygon_corners(position), width=0)
+def draw_life(screen:pg.Surface, life_packs:Dict[lv.Living, Living_package], dirty:List[pg.Rect]):
+	for liv, l_pack in life_packs.items():
+		if l_pack.rect.collidelist(dirty) != -1:
+			screen.blit(l_pack.img, l_pack.rect)
 
+def living_rect(position:te.Terrain, img:pg.Surface, land:ld.Land):
 	l_x, l_y = land.polygon_center(position)
 	img_w, img_h = img.get_size()
-	img_coord = (l_x - img_w//2, l_y - img_h//2)
-	screen.blit(img, img_coord)
+	return pg.Rect(round(l_x - img_w / 2), round(l_y - img_h / 2), img_w, img_h)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+# where a world's big per-cell arrays live. InMemory is the default; Mapped
+# keeps every array in a .npy file opened as a memory map, so the OS pages
+# in only the parts of a huge land that are in use. Checkpoints do not point
+# at these files; they store the arrays themselves and a resumed world maps
+# fresh copies.
+import os
+import re
+import numpy as np
+from typing import Dict
+
+class InMemory:
+	def __repr__(self):
+		return 'InMemory()'
+
+	def array(self, name:str, shape:tuple, dtype:type, fill:'Any' = 0):
+		return np.full(shape, fill, dtype=dtype) if fill else np.zeros(shape, dtype=dtype)
+
+	def release(self, array:np.ndarray):
+		pass
+
+	def flush(self):
+		pass
+
+	def prune(self):
+		pass
+
+# the file names Mapped gives its arrays: name-generation.npy
+Pattern = re.compile(r'^(\w+)-(\d+)\.npy$')
+
+class Mapped:
+	def __init__(self, directory:str):
+		self.directory = directory
+		self.arrays = {} #Dict[str, np.memmap], by file name
+		os.makedirs(directory, exist_ok=True)
+		# numbered past anything already there, so no earlier run's file is overwritten
+		self.generation = max([generation(f) for f in os.listdir(directory) if Pattern.match(f)], default=0)
+
+	def __repr__(self):
+		return 'Mapped(directory:{}, arrays:{})'.format(self.directory, len(self.arrays))
+
+	def track(self, array:np.memmap, file:str):
+		self.arrays[file] = array
+		return array
+
+	def release(self, array:np.memmap):
+		# for arrays that were replaced, e.g. by a grown copy. Where the OS
+		# refuses to delete a mapped file, it is only left behind; arrays that
+		# are not mapped files are none of its business
+		if not isinstance(array, np.memmap):
+			return
+		file = file_of(array)
+		self.arrays.pop(file, None)
+		try:
+			os.remove(os.path.join(self.directory, file))
+		except OSError:
+			pass
+
+	def array(self, name:str, shape:tuple, dtype:type, fill:'Any' = 0):
+		# a new file every time, so growing an array never overwrites the one
+		# it is copied from
+		self.generation += 1
+		file = '{}-{}.npy'.format(name, self.generation)
+		array = np.lib.format.open_memmap(os.path.join(self.directory, file), mode='w+', dtype=dtype, shape=shape)
+		if fill:
+			array[...] = fill
+		return self.track(array, file)
+
+	def open(self, file:str):
+		# an array written by an earlier run, e.g. when resuming a checkpoint
+		array = np.lib.format.open_memmap(os.path.join(self.directory, file), mode='r+')
+		self.generation = max(self.generation, generation(file))
+		return self.track(array, file)
+
+	def flush(self):
+		for array in list(self.arrays.values()):
+			array.flush()
+
+	def prune(self):
+		# deletes what earlier runs left in the directory, e.g. the arrays of the
+		# run a checkpoint came from: files named like the arrays held here but
+		# not opened. Anything else in the directory is left alone
+		names = {Pattern.match(f).group(1) for f in self.arrays}
+		for f in os.listdir(self.directory):
+			match = Pattern.match(f)
+			if match and match.group(1) in names and f not in self.arrays:
+				try:
+					os.remove(os.path.join(self.directory, f))
+				except OSError:
+					pass
+
+def generation(file:str):
+	return int(Pattern.match(file).group(2))
+
+def file_of(array:np.ndarray):
+	# the Mapped file name behind an array
+	return os.path.basename(array.filename)
+
+
+# Tests
+
+def complain(name:str):
+	print("FAIL {0}".format(name))
+
+def equal_int(name:str, a:int, b:int):
+	if not (a == b):
+		complain(name)
+
+def test_mapped():
+	import tempfile
+	with tempfile.TemporaryDirectory() as tmp:
+		storage = Mapped(tmp)
+		a = storage.array('passable', (1000,), bool, fill=True)
+		b = storage.array('strength', (1000, 4), np.int32)
+		b[10, 2] = 7
+		storage.flush()
+		equal_int('mapped fill', bool(a.all()), True)
+		equal_int('mapped file', np.load(os.path.join(tmp, file_of(b)))[10, 2], 7)
+
+		storage.release(b)
+		equal_int('mapped released', os.path.exists(os.path.join(tmp, file_of(b))), False)
+
+		reopened = Mapped(tmp).open(file_of(a))
+		equal_int('mapped open', bool(reopened.all()), True)
+		equal_int('mapped generation', file_of(Mapped(tmp).array('passable', (1,), bool)) != file_of(a), True)
+
+		# files it did not name are neither numbered nor pruned
+		for f in ('metrics_00000.npy', 'my-data.npy', 'other-7.npy'):
+			np.save(os.path.join(tmp, f), np.zeros(1))
+		storage = Mapped(tmp)
+		equal_int('mapped foreign files', storage.generation, 7)
+		kept = storage.array('passable', (1,), bool)
+		storage.prune()
+		equal_int('mapped pruned', sorted(os.listdir(tmp)), sorted([file_of(kept), 'metrics_00000.npy', 'my-data.npy', 'other-7.npy']))
+
+def test_all():
+	test_mapped()
+
+if __name__ == '__main__':
+	test_all()
@@ -6,9 +6,14 @@ Emission = collections.namedtuple('Emission', ('smells',))
 class Terrain:
 	def __init__(self, p:'Polygon'):
 		self.polygon = p
-		self.smells = {}
+		self.cell = None #int, row in the Land's SmellField
+		self.field = None #SmellField
+		self.land = None #Land
+		self.passable = True # change through Land.set_passable
+		self._smells = {}
 		self.emission = Emission({})
-		self.neighbors = {} #Dict[Polygon, Terrain]
+		self._neighbors = None #Dict[Polygon, Terrain], built on first use
+		self._open_neighbors = None #(Land.version, List[Terrain])
 
 	def __repr__(self):
 		return 'Terrain(coords:{}, smells:{})'.format(self.polygon, len(self.smells))
@@ -22,6 +27,38 @@ class Terrain:
 	def __eq__(self, other:'Terrain'):
 		return (self.polygon) == (other.polygon)
 
+	@property
+	def neighbors(self):
+		if self._neighbors is None:
+			self._neighbors = self.land.neighborhood(self) if self.land is not None else {}
+		return self._neighbors
+
+	@neighbors.setter
+	def neighbors(self, neighbors:dict):
+		self._neighbors = neighbors
+
+	def open_neighbors(self):
+		# passable neighbors as a list, rebuilt only after the land's terrain changes
+		version = self.land.version if self.land is not None else 0
+		if self._open_neighbors is None or self._open_neighbors[0] != version:
+			self._open_neighbors = (version, [n for n in self.neighbors.values() if n.passable])
+		return self._open_neighbors[1]
+
+	@property
+	def smells(self):
+		if self.field is None:
+			return self._smells
+		return self.field.smells_at(self.cell)
+
+	@smells.setter
+	def smells(self, smells:dict):
+		if self.field is None:
+			self._smells = smells
+		else:
+			view = self.smells
+			view.clear()
+			view.update(smells)
+
 	def decay(self):
 		self.smells = {source: lv.decay_smell(s) for (source, s) in self.smells.items() if lv.decay_smell(s).strength > 0}
 